@@ -0,0 +1,184 @@
+"""Архив сырых ответов event_listings_v2, чтобы после изменения схемы или исправления разбора
+можно было пересобрать данные без браузеров.
+
+    {ARCHIVE_DIR}/2025-03-14/{host}-{pid}-{n}.seg.zst   - сжатые ответы подряд, каждый отдельным кадром
+    {ARCHIVE_DIR}/2025-03-14/{host}-{pid}-{n}.idx       - event_id, scraped_at, task_name, offset, length
+
+Сегменты только дописываются; каждый процесс пишет в свои. Строка индекса появляется после
+того, как кадр записан, так что индекс не ссылается на недописанные данные.
+Целиком сегмент читается и обычными zstd -d / gzip -d.
+"""
+import gzip
+import os
+import queue
+import socket
+import threading
+from collections import namedtuple
+from datetime import datetime, date
+from config.settings import settings
+from parser.decoding import decompress
+from utils.logger import Logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CODEC_SUFFIXES = {'zstd': '.seg.zst', 'gzip': '.seg.gz'}
+
+ArchivedPayload = namedtuple('ArchivedPayload', ['event_id', 'scraped_at', 'task_name', 'body'])
+
+IndexEntry = namedtuple('IndexEntry', ['segment', 'event_id', 'scraped_at', 'task_name', 'offset', 'length'])
+
+
+def archive_codec() -> str:
+    if settings.archive.codec == 'zstd' and zstandard is None:
+        return 'gzip'
+    return settings.archive.codec
+
+
+class PayloadArchive(threading.Thread):
+    """Пишет ответы в архив в отдельном потоке. submit() никогда не блокирует воркера:
+    если очередь переполнена, ответ не архивируется.
+    """
+
+    def __init__(self):
+        super().__init__(name='payload-archive', daemon=True)
+        self.logger = Logger().get_logger(__name__)
+        self.queue = queue.Queue(maxsize=settings.archive.queue_size)
+        self.codec = archive_codec()
+        self.segment_limit = settings.archive.segment_mb * 1024 * 1024
+        self.prefix = f"{socket.gethostname()}-{os.getpid()}"
+        self.compressor = zstandard.ZstdCompressor(level=settings.archive.level) if self.codec == 'zstd' else None
+        self.segment = None
+        self.index = None
+        self.segment_day = None
+        self.sequence = 0
+        self.dropped = 0
+
+    def submit(self, event_id, task_name: str, body: bytes, content_encoding: str = None) -> None:
+        try:
+            self.queue.put_nowait((event_id, task_name, datetime.utcnow().replace(microsecond=0),
+                                   body, content_encoding))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                self.logger.warning(f"Архив не успевает, пропущено ответов: {self.dropped}")
+
+    def close(self, timeout: float = None) -> None:
+        self.queue.put(None)
+        self.join(timeout)
+
+    def run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                try:
+                    self.write(*item)
+                except Exception as ex:
+                    self.logger.error(f"Ошибка записи в архив: {ex}")
+        finally:
+            self.close_segment()
+
+    def compress(self, data: bytes) -> bytes:
+        if self.compressor:
+            return self.compressor.compress(data)
+        return gzip.compress(data, compresslevel=min(settings.archive.level, 9))
+
+    def write(self, event_id, task_name: str, scraped_at: datetime, body: bytes, content_encoding: str) -> None:
+        # Храним распакованный JSON, сжатый своим кодеком, - чтение не зависит от того, как его отдал сервер
+        frame = self.compress(decompress(body, content_encoding))
+        self.open_segment(scraped_at.date(), len(frame))
+        offset = self.segment.tell()
+        self.segment.write(frame)
+        self.segment.flush()
+        self.index.write(f"{event_id}\t{scraped_at.isoformat()}\t{task_name}\t{offset}\t{len(frame)}\n")
+        self.index.flush()
+
+    def open_segment(self, day: date, frame_size: int) -> None:
+        """Новый сегмент при смене дня или если текущий перерастёт ARCHIVE_SEGMENT_MB"""
+        if self.segment and self.segment_day == day and self.segment.tell() + frame_size <= self.segment_limit:
+            return
+        self.close_segment()
+        day_dir = os.path.join(settings.archive.dir, day.isoformat())
+        os.makedirs(day_dir, exist_ok=True)
+        while True:
+            self.sequence += 1
+            base = os.path.join(day_dir, f"{self.prefix}-{self.sequence}")
+            if not os.path.exists(base + '.idx'):
+                break
+        self.segment = open(base + CODEC_SUFFIXES[self.codec], 'ab')
+        self.index = open(base + '.idx', 'a', encoding='utf-8')
+        self.segment_day = day
+
+    def close_segment(self) -> None:
+        for file in (self.segment, self.index):
+            if file:
+                file.close()
+        self.segment = None
+        self.index = None
+
+
+def segment_path(index_path: str) -> str | None:
+    base = index_path[:-len('.idx')]
+    for suffix in CODEC_SUFFIXES.values():
+        if os.path.exists(base + suffix):
+            return base + suffix
+    return None
+
+
+def iter_index(archive_dir: str = None, date_from: date = None, date_to: date = None):
+    """Записи индексов архива за дни [date_from, date_to] в порядке дней и файлов"""
+    archive_dir = archive_dir or settings.archive.dir
+    if not os.path.isdir(archive_dir):
+        return
+    for day_name in sorted(os.listdir(archive_dir)):
+        try:
+            day = date.fromisoformat(day_name)
+        except ValueError:
+            continue
+        if (date_from and day < date_from) or (date_to and day > date_to):
+            continue
+        day_dir = os.path.join(archive_dir, day_name)
+        for name in sorted(os.listdir(day_dir)):
+            if not name.endswith('.idx'):
+                continue
+            index_path = os.path.join(day_dir, name)
+            segment = segment_path(index_path)
+            if not segment:
+                continue
+            with open(index_path, encoding='utf-8') as file:
+                for line in file:
+                    parts = line.rstrip('\n').split('\t')
+                    # последняя строка могла не дописаться при падении процесса
+                    if len(parts) != 5:
+                        continue
+                    event_id, scraped_at, task_name, offset, length = parts
+                    yield IndexEntry(segment, event_id, datetime.fromisoformat(scraped_at),
+                                     task_name, int(offset), int(length))
+
+
+def read_frame(file, entry: IndexEntry) -> bytes:
+    file.seek(entry.offset)
+    frame = file.read(entry.length)
+    if entry.segment.endswith(CODEC_SUFFIXES['zstd']):
+        return zstandard.ZstdDecompressor().decompressobj().decompress(frame)
+    return gzip.decompress(frame)
+
+
+def iter_payloads(entries):
+    """ArchivedPayload для каждой записи индекса; сегмент открывается один раз на подряд идущие записи"""
+    file = None
+    try:
+        for entry in entries:
+            if file is None or file.name != entry.segment:
+                if file:
+                    file.close()
+                file = open(entry.segment, 'rb')
+            yield ArchivedPayload(entry.event_id, entry.scraped_at, entry.task_name, read_frame(file, entry))
+    finally:
+        if file:
+            file.close()
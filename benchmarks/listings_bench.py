@@ -0,0 +1,122 @@
+"""Сравнение старого преобразования листингов (словарь на листинг + 21 dict.get на строку)
+с parser.listings.listings_to_rows на синтетическом ответе event_listings_v2.
+
+    python -m benchmarks.listings_bench --listings 20000 --repeat 5
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+from parser.listings import listings_to_rows
+
+
+def legacy_listing_to_dict(listing: dict) -> dict:
+    seat_numbers = listing.get('ss')
+    seat_numbers_str = ','.join(map(str, seat_numbers)) if seat_numbers else None
+    cache_time = datetime.utcnow().replace(microsecond=0)
+    scores = listing.get('dq') or {}
+    return {
+        "event_id": listing.get('e'),
+        "listing_id": listing.get('id'),
+        "section_id": listing.get('s'),
+        "section_name": listing.get('sf'),
+        "section_name_raw": listing.get('sr'),
+        "row_name": listing.get('r'),
+        "seat_numbers": seat_numbers_str,
+        "ticket_quantity_lots": listing.get('q'),
+        "ticket_quantity": listing.get('q'),
+        "value_score": scores.get('dq'),
+        "quality_score": scores.get('ddq'),
+        "listing_notes": listing.get('ptd'),
+        "display_price_pre_checkout": listing.get('p'),
+        "all_in_price_pre_checkout": listing.get('pf'),
+        "display_price_checkout": listing.get('dp'),
+        "buyer_fee_checkout": listing.get('f'),
+        "other_fee_checkout": None,
+        "sales_tax_checkout": None,
+        "all_in_price_checkout": listing.get('dp'),
+        "cache_time": cache_time
+    }
+
+
+def legacy_listing_to_row(listing: dict, task_name: str) -> tuple:
+    return (
+        listing.get('event_id'),
+        listing.get('listing_id'),
+        listing.get('section_id'),
+        listing.get('section_name'),
+        listing.get('section_name_raw'),
+        listing.get('row_name'),
+        listing.get('seat_numbers'),
+        listing.get('ticket_quantity_lots'),
+        listing.get('ticket_quantity'),
+        listing.get('value_score'),
+        listing.get('quality_score'),
+        listing.get('listing_notes'),
+        listing.get('display_price_pre_checkout'),
+        listing.get('all_in_price_pre_checkout'),
+        listing.get('display_price_checkout'),
+        listing.get('buyer_fee_checkout'),
+        listing.get('other_fee_checkout'),
+        listing.get('sales_tax_checkout'),
+        listing.get('all_in_price_checkout'),
+        listing.get('cache_time'),
+        task_name,
+        listing['cache_time'].date()
+    )
+
+
+def legacy_rows(listings: list, task_name: str) -> list[tuple]:
+    """Путь GetTickets до listings_to_rows"""
+    return [legacy_listing_to_row(legacy_listing_to_dict(listing), task_name) for listing in listings]
+
+
+def make_listings(count: int, seed: int = 1) -> list[dict]:
+    rng = random.Random(seed)
+    listings = []
+    for i in range(count):
+        price = round(rng.uniform(20, 2000), 2)
+        listings.append({
+            'e': 6110187,
+            'id': f"{rng.getrandbits(40):x}",
+            's': f"{rng.randint(100, 350)}",
+            'sf': f"Section {rng.randint(100, 350)}",
+            'sr': f"SEC{rng.randint(100, 350)}",
+            'r': str(rng.randint(1, 40)),
+            'ss': [rng.randint(1, 30) for _ in range(rng.randint(0, 4))] or None,
+            'q': rng.randint(1, 8),
+            'dq': {'dq': rng.random() * 10, 'ddq': rng.random() * 10} if i % 7 else None,
+            'ptd': 'Instant download' if i % 3 == 0 else None,
+            'p': price,
+            'pf': round(price * 1.25, 2),
+            'dp': round(price * 1.3, 2),
+            'f': round(price * 0.25, 2),
+        })
+    return listings
+
+
+def best_time(func, *args, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Скорость преобразования листингов')
+    parser.add_argument('--listings', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    listings = make_listings(args.listings)
+    # Время снимка у старого пути своё на каждый листинг - сравниваем всё, кроме него
+    assert [row[:-3] for row in legacy_rows(listings, 't')] == [row[:-3] for row in listings_to_rows(listings, 't')]
+
+    legacy = best_time(legacy_rows, listings, 't', repeat=args.repeat)
+    fast = best_time(listings_to_rows, listings, 't', repeat=args.repeat)
+    print(f"Листингов: {args.listings}, лучшее из {args.repeat}")
+    print(f"  dict + listing_to_row: {legacy * 1000:8.1f} мс  ({args.listings / legacy:,.0f} листингов/с)")
+    print(f"  listings_to_rows:      {fast * 1000:8.1f} мс  ({args.listings / fast:,.0f} листингов/с)")
+    print(f"  ускорение: x{legacy / fast:.1f}")
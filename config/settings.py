@@ -10,6 +10,13 @@ class Db:
     db_port: int
     table_events:str
     table_tickets:str
+    table_sections:str
+    table_listing_hashes:str
+    table_listings_current:str
+    table_sitemaps:str
+    table_event_urls:str
+    pool_size: int
+    bulk_load: bool
 
 @dataclass
 class Logs:
@@ -18,15 +25,127 @@ class Logs:
     format: str
     separate_log_without_rollover: bool
 
+@dataclass
+class Workers:
+    count: int
+    start_delay: float
+    restart_backoff: float
+    restart_backoff_max: float
+    drain_timeout: float
+    status_interval: float
+
+@dataclass
+class Tasks:
+    claim_batch_size: int
+    lease_timeout: int
+    reaper_interval: int
+    idle_interval: float
+
+@dataclass
+class Writer:
+    queue_size: int
+    batch_rows: int
+    flush_interval: float
+
+@dataclass
+class Tickets:
+    partitioned: bool
+    delta_mode: bool
+    current_table: bool
+    partitions_ahead: int
+    retention_days: int
+    maintenance_interval: int
+    delta_refresh_days: int
+
+@dataclass
+class Discovery:
+    concurrency: int
+    max_retries: int
+    backoff: float
+    timeout: int
+    full_refresh: bool
+
+@dataclass
+class Scheduler:
+    enabled: bool
+    interval: int
+    recrawl_interval: int
+    recrawl_min: int
+    recrawl_max: int
+    recrawl_shrink: float
+    recrawl_grow: float
+    retry_delay: int
+    change_alpha: float
+    date_weight: float
+    change_weight: float
+
+@dataclass
+class Capture:
+    mode: str
+    scopes: list
+    blocked_urls: list
+    typed_listings: bool
+
+@dataclass
+class Browsers:
+    pool_size: int
+    template_dir: str
+    max_pages: int
+    max_age: int
+    max_rss_mb: int
+
+@dataclass
+class Autoscale:
+    enabled: bool
+    min_workers: int
+    max_workers: int
+    interval: float
+    cooldown: float
+    cpu_high: float
+    cpu_low: float
+    memory_reserve_mb: int
+    worker_memory_mb: int
+    backlog_per_worker: int
+    page_time_high: float
+
+@dataclass
+class Displays:
+    mode: str
+    count: int
+    base: int
+    size: str
+    check_interval: float
+
+@dataclass
+class Archive:
+    enabled: bool
+    dir: str
+    codec: str
+    level: int
+    segment_mb: int
+    queue_size: int
+
 @dataclass
 class Settings:
     db: Db
     logs: Logs
+    workers: Workers
+    tasks: Tasks
+    writer: Writer
+    tickets: Tickets
+    discovery: Discovery
+    scheduler: Scheduler
+    capture: Capture
+    browsers: Browsers
+    autoscale: Autoscale
+    displays: Displays
+    archive: Archive
     captcha_api_key: str = None
 
 def get_settings(path: str):
     env = Env()
     env.read_env(path, override=True)
+    threads_count = env.int('THREADS_COUNT', 10)
 
     return Settings(
         db=Db(
@@ -37,6 +156,14 @@ def get_settings(path: str):
             db_port=env.int('DB_PORT'),
             table_events='seatgeek_events',
             table_tickets='seatgeek_tickets',
+            table_sections='seatgeek_sections',
+            table_listing_hashes='seatgeek_listing_hashes',
+            table_listings_current='seatgeek_listings_current',
+            table_sitemaps='seatgeek_sitemaps',
+            table_event_urls='seatgeek_event_urls',
+            # mysql-connector не даёт пул больше 32 соединений
+            pool_size=min(env.int('DB_POOL_SIZE', threads_count + 4), 32),
+            bulk_load=env.bool('DB_BULK_LOAD', False),
         ),
         logs=Logs(
             level=env.str('LOGS_LEVEL'),
@@ -44,6 +171,121 @@ def get_settings(path: str):
             format=env.str('LOGS_FORMAT'),
             separate_log_without_rollover=env.str('LOGS_ROLLOVER')
         ),
+        workers=Workers(
+            count=threads_count,
+            start_delay=env.float('WORKER_START_DELAY', 2.0),
+            # пауза перед перезапуском упавшего воркера удваивается, пока он падает подряд
+            restart_backoff=env.float('WORKER_RESTART_BACKOFF', 5.0),
+            restart_backoff_max=env.float('WORKER_RESTART_BACKOFF_MAX', 300.0),
+            drain_timeout=env.float('WORKER_DRAIN_TIMEOUT', 120.0),
+            status_interval=env.float('WORKER_STATUS_INTERVAL', 30.0),
+        ),
+        tasks=Tasks(
+            claim_batch_size=env.int('CLAIM_BATCH_SIZE', 20),
+            lease_timeout=env.int('LEASE_TIMEOUT', 600),
+            reaper_interval=env.int('LEASE_REAPER_INTERVAL', 60),
+            # пауза воркера, когда в очереди нет событий, которые пора обходить
+            idle_interval=env.float('TASKS_IDLE_INTERVAL', 30),
+        ),
+        writer=Writer(
+            queue_size=env.int('WRITER_QUEUE_SIZE', 50),
+            batch_rows=env.int('WRITER_BATCH_ROWS', 5000),
+            flush_interval=env.float('WRITER_FLUSH_INTERVAL', 2.0),
+        ),
+        tickets=Tickets(
+            partitioned=env.bool('TICKETS_PARTITIONED', True),
+            delta_mode=env.bool('TICKETS_DELTA_MODE', False),
+            current_table=env.bool('TICKETS_CURRENT_TABLE', True),
+            partitions_ahead=env.int('TICKETS_PARTITIONS_AHEAD', 7),
+            # 0 - хранить всё
+            retention_days=env.int('TICKETS_RETENTION_DAYS', 90),
+            maintenance_interval=env.int('TICKETS_MAINTENANCE_INTERVAL', 3600),
+            # в delta-режиме неизменный листинг переписывается полным снимком раз в столько дней
+            # (не реже чем за день до TICKETS_RETENTION_DAYS), чтобы удаление партиций его не теряло
+            delta_refresh_days=env.int('TICKETS_DELTA_REFRESH_DAYS', 30),
+        ),
+        discovery=Discovery(
+            concurrency=env.int('SITEMAP_CONCURRENCY', 8),
+            max_retries=env.int('SITEMAP_MAX_RETRIES', 3),
+            backoff=env.float('SITEMAP_BACKOFF', 1.0),
+            timeout=env.int('SITEMAP_TIMEOUT', 10),
+            full_refresh=env.bool('DISCOVERY_FULL_REFRESH', False),
+        ),
+        scheduler=Scheduler(
+            enabled=env.bool('SCHEDULER_ENABLED', True),
+            interval=env.int('SCHEDULER_INTERVAL', 300),
+            # начальный интервал, дальше у каждого события свой: сжимается при изменениях листингов
+            # и растёт, пока они не меняются, в пределах [RECRAWL_MIN_INTERVAL, RECRAWL_MAX_INTERVAL]
+            recrawl_interval=env.int('RECRAWL_INTERVAL', 86400),
+            recrawl_min=env.int('RECRAWL_MIN_INTERVAL', 1800),
+            recrawl_max=env.int('RECRAWL_MAX_INTERVAL', 7 * 86400),
+            recrawl_shrink=env.float('RECRAWL_SHRINK', 0.5),
+            recrawl_grow=env.float('RECRAWL_GROW', 1.5),
+            retry_delay=env.int('RETRY_DELAY', 900),
+            # вес последнего обхода в скользящей доле изменений
+            change_alpha=env.float('CHANGE_RATE_ALPHA', 0.3),
+            date_weight=env.float('PRIORITY_DATE_WEIGHT', 1.0),
+            change_weight=env.float('PRIORITY_CHANGE_WEIGHT', 1.0),
+        ),
+        capture=Capture(
+            # wire - selenium-wire и опрос driver.requests, cdp - события DevTools без mitmproxy
+            mode=env.str('CAPTURE_MODE', 'wire'),
+            # регулярки URL, которые selenium-wire сохраняет, остальное проходит без записи
+            scopes=env.list('CAPTURE_SCOPES', [r'.*/api/event_listings_v2.*']),
+            # шаблоны Network.setBlockedURLs (* - любая подстрока), пустой список - ничего не блокировать
+            blocked_urls=env.list('CAPTURE_BLOCKED_URLS', [
+                '*.woff', '*.woff2', '*.ttf', '*.otf',
+                '*.mp4', '*.webm', '*.mp3', '*.m3u8',
+                '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+                '*connect.facebook.net*', '*hotjar.com*', '*segment.io*', '*sentry.io*',
+            ]),
+            # разбирать листинги сразу в структуры msgspec (если он установлен). С orjson
+            # быстрее не становится (20000 листингов: ~88 мс против ~78 мс), поэтому выключено
+            typed_listings=env.bool('CAPTURE_TYPED_LISTINGS', False),
+        ),
+        browsers=Browsers(
+            # сколько запасных Chrome держит наготове каждый процесс воркера, 0 - без пула.
+            # Всего Chrome: THREADS_COUNT * (1 + BROWSER_POOL_SIZE), каждый до BROWSER_MAX_RSS_MB памяти
+            pool_size=env.int('BROWSER_POOL_SIZE', 1),
+            template_dir=env.str('BROWSER_TEMPLATE_DIR', 'chrome_data/_template'),
+            # браузер заменяется после стольких событий, минут работы или мегабайт RSS; 0 - без ограничения
+            max_pages=env.int('BROWSER_MAX_PAGES', 200),
+            max_age=env.int('BROWSER_MAX_AGE', 60),
+            max_rss_mb=env.int('BROWSER_MAX_RSS_MB', 1500),
+        ),
+        autoscale=Autoscale(
+            enabled=env.bool('AUTOSCALE_ENABLED', False),
+            min_workers=env.int('AUTOSCALE_MIN_WORKERS', 1),
+            max_workers=env.int('AUTOSCALE_MAX_WORKERS', threads_count),
+            interval=env.float('AUTOSCALE_INTERVAL', 60.0),
+            # после изменения числа воркеров метрики должны успеть устояться
+            cooldown=env.float('AUTOSCALE_COOLDOWN', 180.0),
+            cpu_high=env.float('AUTOSCALE_CPU_HIGH', 0.85),
+            cpu_low=env.float('AUTOSCALE_CPU_LOW', 0.6),
+            memory_reserve_mb=env.int('AUTOSCALE_MEMORY_RESERVE_MB', 1024),
+            # память процесса воркера вместе с его Chrome, включая запасные из BROWSER_POOL_SIZE
+            worker_memory_mb=env.int('AUTOSCALE_WORKER_MEMORY_MB', 800),
+            backlog_per_worker=env.int('AUTOSCALE_BACKLOG_PER_WORKER', 10),
+            page_time_high=env.float('AUTOSCALE_PAGE_TIME_HIGH', 45.0),
+        ),
+        displays=Displays(
+            # xvfb - общие Xvfb-серверы, headless - Chrome без дисплея
+            mode=env.str('DISPLAY_MODE', 'xvfb'),
+            count=env.int('DISPLAY_COUNT', 2),
+            # номера :90, :91, ... - не пересекаются с :0 из Dockerfile
+            base=env.int('DISPLAY_BASE', 90),
+            size=env.str('DISPLAY_SIZE', '1920x1080'),
+            check_interval=env.float('DISPLAY_CHECK_INTERVAL', 30.0),
+        ),
+        archive=Archive(
+            enabled=env.bool('ARCHIVE_ENABLED', False),
+            dir=env.str('ARCHIVE_DIR', 'payload_archive'),
+            # zstd или gzip; без пакета zstandard всегда gzip
+            codec=env.str('ARCHIVE_CODEC', 'zstd'),
+            level=env.int('ARCHIVE_LEVEL', 3),
+            segment_mb=env.int('ARCHIVE_SEGMENT_MB', 256),
+            queue_size=env.int('ARCHIVE_QUEUE_SIZE', 200),
+        ),
         captcha_api_key=env.str('TWOCAPTCHA', default=None)
     )
 
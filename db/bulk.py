@@ -0,0 +1,86 @@
+import os
+import tempfile
+from datetime import datetime
+from mysql.connector import Error, errorcode
+from db.core import Db
+from utils.logger import Logger
+
+
+# Ошибки, означающие, что сервер или клиент запрещает LOAD DATA LOCAL INFILE
+LOCAL_INFILE_ERRORS = (
+    errorcode.ER_NOT_ALLOWED_COMMAND,
+    errorcode.ER_CLIENT_LOCAL_FILES_DISABLED,
+    errorcode.CR_LOAD_DATA_LOCAL_INFILE_REJECTED,
+)
+
+_TSV_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '\t': '\\t',
+    '\n': '\\n',
+    '\r': '\\r',
+    '\0': '\\0',
+})
+
+logger = Logger().get_logger(__name__)
+_local_infile_allowed = True
+
+
+def to_tsv_value(value) -> str:
+    if value is None:
+        return '\\N'
+    if isinstance(value, str):
+        return value.translate(_TSV_ESCAPES)
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+def write_tsv(file, rows) -> int:
+    count = 0
+    for row in rows:
+        file.write('\t'.join(map(to_tsv_value, row)))
+        file.write('\n')
+        count += 1
+    return count
+
+
+def bulk_load(db: Db, table: str, columns: tuple, rows, ignore: bool = False) -> bool:
+    """Загружает строки через временный TSV-файл и LOAD DATA LOCAL INFILE в staging-таблицу,
+    затем переносит их в table одним INSERT ... SELECT. Коммит остаётся за вызывающим кодом.
+    Возвращает False, если LOCAL INFILE запрещён, - тогда нужно писать через executemany.
+    """
+    global _local_infile_allowed
+    if not _local_infile_allowed:
+        return False
+    staging = f"{table}_staging"
+    column_list = ', '.join(columns)
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as file:
+            if not write_tsv(file, rows):
+                return True
+        db.execute(f"DROP TEMPORARY TABLE IF EXISTS {staging}")
+        db.execute(f"CREATE TEMPORARY TABLE {staging} AS SELECT {column_list} FROM {table} WHERE 1=0")
+        try:
+            db.execute(f"""
+                LOAD DATA LOCAL INFILE %s INTO TABLE {staging}
+                CHARACTER SET utf8mb4
+                FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+                LINES TERMINATED BY '\\n'
+                ({column_list})
+            """, (path,))
+            db.execute(f"""
+                INSERT {'IGNORE ' if ignore else ''}INTO {table} ({column_list})
+                SELECT {column_list} FROM {staging}
+            """)
+        finally:
+            db.execute(f"DROP TEMPORARY TABLE IF EXISTS {staging}")
+        return True
+    except Error as e:
+        if e.errno not in LOCAL_INFILE_ERRORS:
+            raise
+        _local_infile_allowed = False
+        logger.warning(f"LOAD DATA LOCAL INFILE недоступен, переключаюсь на executemany: {e}")
+        return False
+    finally:
+        os.remove(path)
@@ -1,50 +1,218 @@
-from mysql.connector import connect, Error
+from mysql.connector import connect, Error, errorcode
+from mysql.connector.pooling import MySQLConnectionPool
+import threading
 import time
+from datetime import date, timedelta
 from config.settings import settings
 from utils.logger import Logger
 
 
+RECONNECT_ERRORS = (
+    errorcode.CR_SERVER_GONE_ERROR,
+    errorcode.CR_SERVER_LOST,
+    errorcode.CR_SERVER_LOST_EXTENDED,
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> MySQLConnectionPool:
+    """Один пул соединений на процесс, общий для всех потоков"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = MySQLConnectionPool(
+                pool_name='seatgeek',
+                pool_size=settings.db.pool_size,
+                pool_reset_session=True,
+                allow_local_infile=settings.db.bulk_load,
+                host=settings.db.db_host,
+                port=settings.db.db_port,
+                user=settings.db.db_user,
+                password=settings.db.db_password,
+                database=settings.db.db_database
+            )
+    return _pool
+
+
+def partition_name(day: date) -> str:
+    return day.strftime('p%Y%m%d')
+
+
 class Db():
     def __init__(self):
         self.logger = Logger().get_logger(__name__)
+        self.connection = None
+        self.cursor = None
         self.connecting()
         self.table_events= settings.db.table_events
         self.table_tickets= settings.db.table_tickets
+        self.table_sections= settings.db.table_sections
+        self.table_listing_hashes= settings.db.table_listing_hashes
+        self.table_listings_current= settings.db.table_listings_current
+        self.table_sitemaps= settings.db.table_sitemaps
+        self.table_event_urls= settings.db.table_event_urls
 
-    def connecting(self, max_retries=10, delay=5) -> None:    
+    def connecting(self, max_retries=10, delay=0.5) -> None:
+        """Берёт соединение из пула. Ждёт с экспоненциальной паузой, если пул занят или MySQL недоступен"""
         for attempt in range(max_retries):
             try:
-                self.connection = connect(
-                    host=settings.db.db_host,
-                    port=settings.db.db_port,
-                    user=settings.db.db_user,
-                    password=settings.db.db_password,
-                    database=settings.db.db_database
-                )
+                self.connection = get_pool().get_connection()
+                if not self.connection.is_connected():
+                    self.connection.reconnect(attempts=3, delay=1)
                 self.cursor = self.connection.cursor()
                 return 
             except Error as e:
                 self.logger.error(f"Connection failed: {e}")
-                time.sleep(delay)
+                self.close_connection()
+                time.sleep(min(delay * 2 ** attempt, 10))
         raise Exception("Could not connect to the database after multiple attempts")
 
+    def reconnect(self) -> None:
+        try:
+            self.cursor.close()
+        except Error:
+            pass
+        self.connection.reconnect(attempts=5, delay=1)
+        self.cursor = self.connection.cursor()
+
+    def execute(self, sql: str, params: tuple = None, many: bool = False) -> None:
+        """Выполняет запрос, при разрыве соединения ("MySQL server has gone away") переподключается.
+        Запрос повторяется, только если транзакция не была начата: иначе её незакоммиченные запросы
+        пропали вместе с сессией, и ошибка пробрасывается - повторить всю транзакцию должен вызывающий код.
+        """
+        for attempt in range(2):
+            try:
+                if many:
+                    self.cursor.executemany(sql, params)
+                elif params:
+                    self.cursor.execute(sql, params)
+                else:
+                    self.cursor.execute(sql)
+                return
+            except Error as e:
+                if attempt or e.errno not in RECONNECT_ERRORS:
+                    raise
+                try:
+                    in_transaction = self.connection.in_transaction
+                except Error:
+                    in_transaction = True
+                self.logger.warning(f"Соединение с MySQL потеряно, переподключение: {e}")
+                self.reconnect()
+                if in_transaction:
+                    raise
+
     def __del__(self):
         self.close_connection()
 
     def insert(self, sql: str, params: tuple = None) -> None:
-        if not params:
-            self.cursor.execute(sql)
-        else:
-            self.cursor.execute(sql, params)
+        self.execute(sql, params)
+        self.connection.commit()
+
+    def insert_many(self, sql: str, values_list: list) -> None:
+        self.execute(sql, values_list, many=True)
         self.connection.commit()
 
     def select(self, sql: str) -> list:
-        self.cursor.execute(sql)
+        self.execute(sql)
         rows = self.cursor.fetchall() 
         return rows
-        
+
+    def claim_events(self, owner: str, batch_size: int) -> list:
+        """Забирает пачку необработанных событий одной транзакцией и оформляет аренду на owner.
+        Возвращает: [(id, event_id, event_url, task_name), ...]
+        """
+        try:
+            self.connection.commit()
+            self.execute(f"""
+                SELECT id, event_id, event_url, task_name FROM {self.table_events}
+                WHERE status IS NULL AND (next_due_at IS NULL OR next_due_at <= NOW())
+                ORDER BY priority DESC, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (batch_size,))
+            rows = self.cursor.fetchall()
+            if rows:
+                placeholders = ', '.join(['%s'] * len(rows))
+                self.cursor.execute(f"""
+                    UPDATE {self.table_events}
+                    SET status='processing', lease_owner=%s, claimed_at=NOW(), heartbeat_at=NOW()
+                    WHERE id IN ({placeholders})
+                """, (owner, *(row[0] for row in rows)))
+            self.connection.commit()
+            return rows
+        except Error:
+            self.connection.rollback()
+            raise
+
+    def renew_leases(self, owner: str, ids) -> set:
+        """Продлевает аренду событий ids, которые воркер owner ещё собирается обойти.
+        Остальные его события в 'processing' не продлеваются - их вернёт LeaseReaper.
+        Возвращает id событий, которые всё ещё за ним.
+        """
+        ids = list(ids)
+        if not ids:
+            return set()
+        placeholders = ', '.join(['%s'] * len(ids))
+        self.insert(f"""
+            UPDATE {self.table_events} SET heartbeat_at=NOW()
+            WHERE lease_owner=%s AND status='processing' AND id IN ({placeholders})
+        """, (owner, *ids))
+        self.execute(f"""
+            SELECT id FROM {self.table_events}
+            WHERE lease_owner=%s AND status='processing' AND id IN ({placeholders})
+        """, (owner, *ids))
+        return {row[0] for row in self.cursor.fetchall()}
+
+    def count_backlog(self) -> int:
+        """Сколько событий ждёт обработки и уже может быть взято"""
+        return self.select(f"""
+            SELECT COUNT(*) FROM {self.table_events}
+            WHERE status IS NULL AND (next_due_at IS NULL OR next_due_at <= NOW())
+        """)[0][0]
+
+    def release_leases(self, owner: str, ids=None) -> int:
+        """Сразу возвращает в очередь события упавшего воркера, не дожидаясь истечения аренды.
+        ids - только эти события (арендованные, но ещё не начатые)
+        """
+        params = [owner]
+        only_ids = ''
+        if ids is not None:
+            ids = list(ids)
+            if not ids:
+                return 0
+            only_ids = f"AND id IN ({', '.join(['%s'] * len(ids))})"
+            params.extend(ids)
+        self.insert(f"""
+            UPDATE {self.table_events}
+            SET status=NULL, lease_owner=NULL, claimed_at=NULL, heartbeat_at=NULL
+            WHERE lease_owner=%s AND status='processing' {only_ids}
+        """, tuple(params))
+        return self.cursor.rowcount
+
+    def reap_expired_leases(self, timeout: int) -> int:
+        """Возвращает в очередь события, аренда которых не продлевалась timeout секунд"""
+        self.insert(f"""
+            UPDATE {self.table_events}
+            SET status=NULL, lease_owner=NULL, claimed_at=NULL, heartbeat_at=NULL
+            WHERE status='processing'
+            AND (heartbeat_at IS NULL OR heartbeat_at < NOW() - INTERVAL %s SECOND)
+        """, (timeout,))
+        return self.cursor.rowcount
+
     def close_connection(self) -> None:
-        self.connection.close()
+        """Возвращает соединение в пул"""
+        if self.connection is None:
+            return
+        try:
+            if self.cursor is not None:
+                self.cursor.close()
+            self.connection.close()
+        except Error:
+            pass
+        self.connection = None
+        self.cursor = None
 
 
 class IsDbCreated():
@@ -74,8 +242,45 @@ class IsDbTable(Db):
     def check(self) -> None:
         if self.check_tables(self.table_events):
             self.create_events()
+        else:
+            self.check_column(self.table_events, 'lease_owner', 'VARCHAR(100)')
+            self.check_column(self.table_events, 'claimed_at', 'DATETIME')
+            self.check_column(self.table_events, 'heartbeat_at', 'DATETIME')
+            self.check_index(self.table_events, 'idx_status_task', '(`status`, `task_name`)')
+            self.check_index(self.table_events, 'idx_status_heartbeat', '(`status`, `heartbeat_at`)')
+            self.check_index(self.table_events, 'idx_lease_owner', '(`lease_owner`)')
+            self.check_column(self.table_events, 'event_date', 'DATETIME')
+            self.check_column(self.table_events, 'priority', 'FLOAT NOT NULL DEFAULT 0')
+            self.check_column(self.table_events, 'change_rate', 'FLOAT NOT NULL DEFAULT 0')
+            self.check_column(self.table_events, 'last_outcome', 'VARCHAR(50)')
+            self.check_column(self.table_events, 'last_scraped_at', 'DATETIME')
+            self.check_column(self.table_events, 'next_due_at', 'DATETIME')
+            self.check_column(self.table_events, 'recrawl_interval', 'INT UNSIGNED')
+            self.check_index(self.table_events, 'idx_status_priority', '(`status`, `priority`)')
+            self.check_index(self.table_events, 'idx_status_due', '(`status`, `next_due_at`)')
+        if self.check_tables(self.table_sitemaps):
+            self.create_sitemaps()
+        if self.check_tables(self.table_event_urls):
+            self.create_event_urls()
+        if self.check_tables(self.table_sections):
+            self.create_sections()
         if self.check_tables(self.table_tickets):
             self.create_tickets()
+        elif self.is_legacy_tickets():
+            self.rename_legacy_tickets()
+        elif settings.tickets.partitioned and not self.is_partitioned_tickets():
+            self.partition_tickets()
+        self.check_column(self.table_tickets, 'change_type',
+                          "ENUM('full', 'new', 'changed', 'removed') NOT NULL DEFAULT 'full'")
+        if self.check_tables(self.table_listing_hashes):
+            self.create_listing_hashes()
+        else:
+            # У старых хэшей дата неизвестна - листинги перепишутся полным снимком при следующем обходе
+            self.check_column(self.table_listing_hashes, 'written_at', "DATE NOT NULL DEFAULT '1970-01-01'")
+        if self.check_tables(self.table_listings_current):
+            self.create_listings_current()
+        self.create_tickets_view()
+        self.create_tickets_latest_view()
 
     def create_events(self) -> None:
         self.insert(f"""
@@ -86,44 +291,222 @@ class IsDbTable(Db):
                 `date_added` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 `task_name` VARCHAR(50) NOT NULL,
                 `status` VARCHAR(50),
+                `lease_owner` VARCHAR(100),
+                `claimed_at` DATETIME,
+                `heartbeat_at` DATETIME,
+                `event_date` DATETIME,
+                `priority` FLOAT NOT NULL DEFAULT 0,
+                `change_rate` FLOAT NOT NULL DEFAULT 0,
+                `last_outcome` VARCHAR(50),
+                `last_scraped_at` DATETIME,
+                `next_due_at` DATETIME,
+                `recrawl_interval` INT UNSIGNED,
                 UNIQUE KEY `unique_event_task` (`event_id`, `task_name`),
-                INDEX `idx_task_name` (`task_name`)
+                INDEX `idx_task_name` (`task_name`),
+                INDEX `idx_status_task` (`status`, `task_name`),
+                INDEX `idx_status_heartbeat` (`status`, `heartbeat_at`),
+                INDEX `idx_lease_owner` (`lease_owner`),
+                INDEX `idx_status_priority` (`status`, `priority`),
+                INDEX `idx_status_due` (`status`, `next_due_at`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+        """)
+
+    def create_sitemaps(self) -> None:
+        """Кэш обхода: валидаторы HTTP и lastmod из индекса для каждого sitemap"""
+        self.insert(f"""
+            CREATE TABLE `{self.table_sitemaps}` (
+                `url` VARCHAR(500) NOT NULL PRIMARY KEY,
+                `etag` VARCHAR(255),
+                `last_modified` VARCHAR(64),
+                `lastmod` VARCHAR(64),
+                `checked_at` DATETIME
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+        """)
+
+    def create_event_urls(self) -> None:
+        """Кэш обхода: последний известный lastmod каждого события из sitemap"""
+        self.insert(f"""
+            CREATE TABLE `{self.table_event_urls}` (
+                `event_id` VARCHAR(255) NOT NULL PRIMARY KEY,
+                `event_url` VARCHAR(500),
+                `lastmod` VARCHAR(64),
+                `first_seen` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                `last_enqueued` DATETIME
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
         """)
 
     def create_tickets(self) -> None:
         self.insert(f"""
             CREATE TABLE `{self.table_tickets}` (
-                `id` BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-                `event_id` VARCHAR(50) NOT NULL,
-                `listing_id` VARCHAR(255),
+                `id` BIGINT NOT NULL AUTO_INCREMENT,
+                `event_id` BIGINT NOT NULL,
+                `listing_id` VARCHAR(64),
                 `section_id` VARCHAR(50),
-                `section_name` VARCHAR(255),
-                `section_name_raw` VARCHAR(255),
+                `section_name_id` INT UNSIGNED,
+                `section_name_raw_id` INT UNSIGNED,
                 `row_name` VARCHAR(50),
-                `seat_numbers` TEXT,
-                `ticket_quantity_lots` VARCHAR(255),
-                `ticket_quantity` VARCHAR(255),
-                `value_score` VARCHAR(255),
-                `quality_score` VARCHAR(255),
+                `seat_numbers` VARCHAR(1000),
+                `ticket_quantity_lots` SMALLINT UNSIGNED,
+                `ticket_quantity` SMALLINT UNSIGNED,
+                `value_score` FLOAT,
+                `quality_score` FLOAT,
                 `listing_notes` TEXT,
-                `display_price_pre_checkout` VARCHAR(255),
-                `all_in_price_pre_checkout` VARCHAR(255),
-                `display_price_checkout` VARCHAR(255),
-                `buyer_fee_checkout` VARCHAR(255),
-                `other_fee_checkout` VARCHAR(255),
-                `sales_tax_checkout` VARCHAR(255),
-                `all_in_price_checkout` VARCHAR(255),
-                `cache_time` VARCHAR(50),
+                `display_price_pre_checkout` DECIMAL(10,2),
+                `all_in_price_pre_checkout` DECIMAL(10,2),
+                `display_price_checkout` DECIMAL(10,2),
+                `buyer_fee_checkout` DECIMAL(10,2),
+                `other_fee_checkout` DECIMAL(10,2),
+                `sales_tax_checkout` DECIMAL(10,2),
+                `all_in_price_checkout` DECIMAL(10,2),
+                `cache_time` DATETIME,
                 `date_added` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 `task_name` VARCHAR(50),
+                `scrape_date` DATE NOT NULL,
+                `change_type` ENUM('full', 'new', 'changed', 'removed') NOT NULL DEFAULT 'full',
+                PRIMARY KEY (`id`, `scrape_date`),
                 INDEX idx_event_id (event_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+            {self.tickets_partitions_sql() if settings.tickets.partitioned else ''};
+        """)
+
+    def tickets_partitions_sql(self) -> str:
+        """Дневные партиции по scrape_date: всё старое в p_history, дальше по дню
+        на partitions_ahead дней вперёд и pmax на случай, если обслуживание не запускалось
+        """
+        today = date.today()
+        partitions = [f"PARTITION p_history VALUES LESS THAN ('{today}')"]
+        for offset in range(settings.tickets.partitions_ahead + 1):
+            day = today + timedelta(days=offset)
+            partitions.append(f"PARTITION {partition_name(day)} VALUES LESS THAN ('{day + timedelta(days=1)}')")
+        partitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+        return f"PARTITION BY RANGE COLUMNS(`scrape_date`) ({', '.join(partitions)})"
+
+    def is_partitioned_tickets(self) -> bool:
+        rows = self.select(f"""
+            SELECT COUNT(*) FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = '{settings.db.db_database}' AND TABLE_NAME = '{self.table_tickets}'
+            AND PARTITION_NAME IS NOT NULL
+        """)
+        return rows[0][0] > 0
+
+    def partition_tickets(self) -> None:
+        """Переводит существующую таблицу на партиции. На большой таблице это полная перестройка"""
+        self.logger.warning(f"Перестройка {self.table_tickets} с партициями по scrape_date...")
+        if not self.select(f"SHOW COLUMNS FROM `{self.table_tickets}` LIKE 'scrape_date'"):
+            self.insert(f"ALTER TABLE `{self.table_tickets}` ADD COLUMN `scrape_date` DATE")
+            self.insert(f"UPDATE `{self.table_tickets}` SET `scrape_date` = DATE(`date_added`)")
+            self.insert(f"""
+                ALTER TABLE `{self.table_tickets}` MODIFY `scrape_date` DATE NOT NULL,
+                DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `scrape_date`)
+            """)
+        self.insert(f"ALTER TABLE `{self.table_tickets}` {self.tickets_partitions_sql()}")
+
+    def create_sections(self) -> None:
+        self.insert(f"""
+            CREATE TABLE `{self.table_sections}` (
+                `id` INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                `name` VARCHAR(255) NOT NULL COLLATE utf8mb4_bin,
+                UNIQUE KEY `unique_name` (`name`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+        """)
+
+    def create_tickets_view(self) -> None:
+        """Представление с названиями секций вместо id - для чтения в старом формате"""
+        self.insert(f"""
+            CREATE OR REPLACE VIEW `{self.table_tickets}_view` AS
+            SELECT t.*, s.name AS section_name, r.name AS section_name_raw
+            FROM `{self.table_tickets}` t
+            LEFT JOIN `{self.table_sections}` s ON s.id = t.section_name_id
+            LEFT JOIN `{self.table_sections}` r ON r.id = t.section_name_raw_id
+        """)
+
+    def create_listing_hashes(self) -> None:
+        """Последний известный хэш каждого листинга - по нему delta-режим решает, что писать.
+        written_at - дата последней строки листинга в seatgeek_tickets
+        """
+        self.insert(f"""
+            CREATE TABLE `{self.table_listing_hashes}` (
+                `event_id` BIGINT NOT NULL,
+                `listing_id` VARCHAR(64) NOT NULL,
+                `listing_hash` BINARY(8) NOT NULL,
+                `written_at` DATE NOT NULL DEFAULT '1970-01-01',
+                PRIMARY KEY (`event_id`, `listing_id`)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
         """)
-    
+
+    def create_listings_current(self) -> None:
+        """Текущие листинги по событию, обновляется писателем вместе с историей"""
+        self.insert(f"""
+            CREATE TABLE `{self.table_listings_current}` (
+                `event_id` BIGINT NOT NULL,
+                `listing_id` VARCHAR(64) NOT NULL,
+                `section_id` VARCHAR(50),
+                `section_name_id` INT UNSIGNED,
+                `section_name_raw_id` INT UNSIGNED,
+                `row_name` VARCHAR(50),
+                `seat_numbers` VARCHAR(1000),
+                `ticket_quantity_lots` SMALLINT UNSIGNED,
+                `ticket_quantity` SMALLINT UNSIGNED,
+                `value_score` FLOAT,
+                `quality_score` FLOAT,
+                `listing_notes` TEXT,
+                `display_price_pre_checkout` DECIMAL(10,2),
+                `all_in_price_pre_checkout` DECIMAL(10,2),
+                `display_price_checkout` DECIMAL(10,2),
+                `buyer_fee_checkout` DECIMAL(10,2),
+                `other_fee_checkout` DECIMAL(10,2),
+                `sales_tax_checkout` DECIMAL(10,2),
+                `all_in_price_checkout` DECIMAL(10,2),
+                `cache_time` DATETIME,
+                `task_name` VARCHAR(50),
+                `scrape_date` DATE NOT NULL,
+                `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                PRIMARY KEY (`event_id`, `listing_id`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+        """)
+
+    def create_tickets_latest_view(self) -> None:
+        """Текущее состояние листингов, восстановленное из истории delta-режима:
+        последняя запись по каждому (event_id, listing_id), если она не 'removed'
+        """
+        self.insert(f"""
+            CREATE OR REPLACE VIEW `{self.table_tickets}_latest` AS
+            SELECT * FROM (
+                SELECT t.*, ROW_NUMBER() OVER (PARTITION BY t.event_id, t.listing_id ORDER BY t.id DESC) AS rn
+                FROM `{self.table_tickets}_view` t
+            ) latest
+            WHERE latest.rn = 1 AND latest.change_type <> 'removed'
+        """)
+
+    def is_legacy_tickets(self) -> bool:
+        """Старая схема: цены и количества в VARCHAR, названия секций прямо в таблице"""
+        return bool(self.select(f"SHOW COLUMNS FROM `{self.table_tickets}` LIKE 'section_name'"))
+
+    def rename_legacy_tickets(self) -> None:
+        """Убирает старую таблицу в {table}_legacy и создаёт новую.
+        Историю переносит отдельная команда: python -m db.migrate
+        """
+        legacy = f"{self.table_tickets}_legacy"
+        self.insert(f"RENAME TABLE `{self.table_tickets}` TO `{legacy}`")
+        self.create_tickets()
+        max_id = self.select(f"SELECT COALESCE(MAX(id), 0) FROM `{legacy}`")[0][0]
+        self.insert(f"ALTER TABLE `{self.table_tickets}` AUTO_INCREMENT = {max_id + 1}")
+        self.logger.warning(f"Таблица {self.table_tickets} переименована в {legacy}, "
+                            f"перенесите историю командой python -m db.migrate")
+
     def check_tables(self, table_name: str) -> bool:
         sql = f"SHOW TABLES FROM {settings.db.db_database} LIKE '{table_name}'"
         rows = self.select(sql)
         if len(rows) == 0:
             return True
-        return False
\ No newline at end of file
+        return False
+
+    def check_column(self, table_name: str, column_name: str, definition: str) -> None:
+        rows = self.select(f"SHOW COLUMNS FROM `{table_name}` LIKE '{column_name}'")
+        if not rows:
+            self.insert(f"ALTER TABLE `{table_name}` ADD COLUMN `{column_name}` {definition}")
+
+    def check_index(self, table_name: str, index_name: str, columns: str) -> None:
+        rows = self.select(f"SHOW INDEX FROM `{table_name}` WHERE Key_name = '{index_name}'")
+        if not rows:
+            self.insert(f"ALTER TABLE `{table_name}` ADD INDEX `{index_name}` {columns}")
\ No newline at end of file
@@ -0,0 +1,19 @@
+from config.settings import settings
+from db.core import Db
+from utils.periodic import PeriodicTask
+
+
+class LeaseReaper(PeriodicTask):
+    """Возвращает в очередь события, которые застряли в 'processing' у упавших воркеров"""
+
+    def __init__(self):
+        super().__init__('lease-reaper', settings.tasks.reaper_interval)
+
+    def tick(self):
+        db = Db()
+        try:
+            count = db.reap_expired_leases(settings.tasks.lease_timeout)
+        finally:
+            db.close_connection()
+        if count:
+            self.logger.warning(f"Возвращено в очередь {count} событий с истёкшей арендой")
@@ -0,0 +1,80 @@
+"""Перенос истории из старой seatgeek_tickets (VARCHAR-схема) в типизированную.
+IsDbTable.check() при старте переименовывает старую таблицу в {table}_legacy,
+эта команда докачивает из неё данные пачками по id и может продолжить после обрыва.
+
+    python -m db.migrate --chunk-size 50000
+"""
+import argparse
+from db.core import Db
+
+
+PRICE_COLUMNS = (
+    'display_price_pre_checkout', 'all_in_price_pre_checkout',
+    'display_price_checkout', 'buyer_fee_checkout',
+    'other_fee_checkout', 'sales_tax_checkout', 'all_in_price_checkout',
+)
+
+
+class TicketsMigration(Db):
+    def __init__(self, chunk_size: int):
+        super().__init__()
+        self.table_legacy = f"{self.table_tickets}_legacy"
+        self.chunk_size = chunk_size
+
+    def run(self) -> None:
+        for column in ('section_name', 'section_name_raw'):
+            self.insert(f"""
+                INSERT IGNORE INTO {self.table_sections} (name)
+                SELECT DISTINCT {column} COLLATE utf8mb4_bin FROM {self.table_legacy}
+                WHERE {column} IS NOT NULL AND {column} <> ''
+            """)
+        max_id = self.select(f"SELECT COALESCE(MAX(id), 0) FROM {self.table_legacy}")[0][0]
+        last_id = self.select(f"SELECT COALESCE(MAX(id), 0) FROM {self.table_tickets} WHERE id <= {max_id}")[0][0]
+        while last_id < max_id:
+            upper_id = last_id + self.chunk_size
+            self.copy_chunk(last_id, upper_id)
+            last_id = upper_id
+            print(f"  Перенесено до id {min(last_id, max_id)} из {max_id}")
+        print(f"✅ Перенос завершён, {self.table_legacy} можно удалить")
+
+    def copy_chunk(self, from_id: int, to_id: int) -> None:
+        prices = ',\n'.join(f"CAST(NULLIF(l.{column}, '') AS DECIMAL(10,2))" for column in PRICE_COLUMNS)
+        self.insert(f"""
+            INSERT INTO {self.table_tickets} (
+                id, event_id, listing_id, section_id, section_name_id, section_name_raw_id,
+                row_name, seat_numbers, ticket_quantity_lots, ticket_quantity,
+                value_score, quality_score, listing_notes,
+                {', '.join(PRICE_COLUMNS)},
+                cache_time, date_added, task_name, scrape_date
+            )
+            SELECT
+                l.id,
+                CAST(l.event_id AS UNSIGNED),
+                NULLIF(l.listing_id, ''),
+                NULLIF(l.section_id, ''),
+                s.id,
+                r.id,
+                NULLIF(l.row_name, ''),
+                NULLIF(l.seat_numbers, ''),
+                CAST(NULLIF(l.ticket_quantity_lots, '') AS UNSIGNED),
+                CAST(NULLIF(l.ticket_quantity, '') AS UNSIGNED),
+                CAST(NULLIF(l.value_score, '') AS DOUBLE),
+                CAST(NULLIF(l.quality_score, '') AS DOUBLE),
+                NULLIF(l.listing_notes, ''),
+                {prices},
+                STR_TO_DATE(NULLIF(l.cache_time, ''), '%m/%d/%Y %H:%i:%s'),
+                l.date_added,
+                l.task_name,
+                DATE(l.date_added)
+            FROM {self.table_legacy} l
+            LEFT JOIN {self.table_sections} s ON s.name = l.section_name COLLATE utf8mb4_bin
+            LEFT JOIN {self.table_sections} r ON r.name = l.section_name_raw COLLATE utf8mb4_bin
+            WHERE l.id > {from_id} AND l.id <= {to_id}
+        """)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Перенос seatgeek_tickets_legacy в новую схему')
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    args = parser.parse_args()
+    TicketsMigration(args.chunk_size).run()
@@ -0,0 +1,89 @@
+"""Обслуживание партиций seatgeek_tickets: заранее создаёт дневные партиции
+и удаляет целиком те, что старше TICKETS_RETENTION_DAYS (вместо DELETE).
+
+    python -m db.partitions [--dry-run]
+"""
+import argparse
+from datetime import date, timedelta
+from config.settings import settings
+from db.core import Db, partition_name
+from utils.periodic import PeriodicTask
+
+
+class TicketPartitions(Db):
+    def get_partitions(self) -> list[tuple[str, date | None]]:
+        """Возвращает [(имя, верхняя граница)], для pmax граница None"""
+        self.execute("""
+            SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION
+        """, (settings.db.db_database, self.table_tickets))
+        partitions = []
+        for name, description in self.cursor.fetchall():
+            bound = None if description == 'MAXVALUE' else date.fromisoformat(description.strip("'"))
+            partitions.append((name, bound))
+        return partitions
+
+    def add_future_partitions(self, partitions: list) -> list[str]:
+        last_bound = max(bound for _, bound in partitions if bound)
+        new_partitions = []
+        day = last_bound
+        while day <= date.today() + timedelta(days=settings.tickets.partitions_ahead):
+            new_partitions.append(f"PARTITION {partition_name(day)} VALUES LESS THAN ('{day + timedelta(days=1)}')")
+            day += timedelta(days=1)
+        if new_partitions:
+            self.insert(f"""
+                ALTER TABLE `{self.table_tickets}` REORGANIZE PARTITION pmax INTO (
+                    {', '.join(new_partitions)},
+                    PARTITION pmax VALUES LESS THAN (MAXVALUE)
+                )
+            """)
+        return new_partitions
+
+    def drop_expired_partitions(self, partitions: list, retention_days: int, dry_run: bool = False) -> list[str]:
+        """Удаляет партиции, в которых все строки старше retention_days"""
+        if retention_days <= 0:
+            return []
+        cutoff = date.today() - timedelta(days=retention_days)
+        expired = [name for name, bound in partitions if bound and bound <= cutoff]
+        if expired and not dry_run:
+            self.insert(f"ALTER TABLE `{self.table_tickets}` DROP PARTITION {', '.join(expired)}")
+        return expired
+
+    def maintain(self, retention_days: int = None, dry_run: bool = False) -> None:
+        partitions = self.get_partitions()
+        if not partitions:
+            self.logger.warning(f"Таблица {self.table_tickets} не разбита на партиции")
+            return
+        if not dry_run:
+            added = self.add_future_partitions(partitions)
+            if added:
+                self.logger.info(f"Добавлено партиций: {len(added)}")
+        if retention_days is None:
+            retention_days = settings.tickets.retention_days
+        dropped = self.drop_expired_partitions(partitions, retention_days, dry_run)
+        if dropped:
+            action = 'К удалению' if dry_run else 'Удалены'
+            self.logger.info(f"{action} партиции старше {retention_days} дней: {', '.join(dropped)}")
+
+
+class TicketPartitionsTask(PeriodicTask):
+    def __init__(self):
+        super().__init__('ticket-partitions', settings.tickets.maintenance_interval)
+
+    def tick(self):
+        partitions = TicketPartitions()
+        try:
+            partitions.maintain()
+        finally:
+            partitions.close_connection()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Обслуживание партиций seatgeek_tickets')
+    parser.add_argument('--retention-days', type=int, default=None)
+    parser.add_argument('--dry-run', action='store_true', help='только показать, что будет удалено')
+    args = parser.parse_args()
+    partitions = TicketPartitions()
+    partitions.maintain(args.retention_days, args.dry_run)
+    partitions.close_connection()
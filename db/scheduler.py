@@ -0,0 +1,145 @@
+from datetime import datetime
+from config.settings import settings
+from db.core import Db
+from utils.periodic import PeriodicTask
+
+
+# event_date - местное время площадки из URL (у части событий только дата, то есть полночь),
+# а NOW() в MySQL - UTC. Событие считается прошедшим только через сутки после event_date,
+# иначе вечерние события в США выпадали бы из очереди за несколько часов до начала
+EVENT_DATE_GRACE = 'INTERVAL 1 DAY'
+
+# Сколько id пересчитывает один UPDATE в reprioritize: блокировки держатся только на этом диапазоне,
+# и claim_events (FOR UPDATE SKIP LOCKED) тем временем забирает события из остальной очереди
+REPRIORITIZE_CHUNK = 5000
+
+# Во сколько раз снижать приоритет события после такого исхода
+OUTCOME_FACTORS = {
+    'failed': 0.7,
+    'no listings': 0.5,
+    'unavailable': 0.1,
+}
+
+
+def priority_sql() -> str:
+    """Приоритет события: чем ближе дата события и чем чаще менялись листинги, тем выше.
+    Неудачный прошлый исход понижает приоритет.
+    """
+    outcomes = ' '.join(f"WHEN '{outcome}' THEN {factor}" for outcome, factor in OUTCOME_FACTORS.items())
+    return f"""(
+        {settings.scheduler.date_weight} * CASE
+            WHEN event_date IS NULL THEN 0.2
+            WHEN event_date + {EVENT_DATE_GRACE} < NOW() THEN 0
+            ELSE 24 / (24 + GREATEST(0, TIMESTAMPDIFF(HOUR, NOW(), event_date)))
+        END
+        + {settings.scheduler.change_weight} * change_rate
+    ) * CASE last_outcome {outcomes} ELSE 1 END"""
+
+
+def next_due(status: str | None) -> str | None:
+    """Когда событие снова нужно обойти: 'recrawl' - через его интервал, 'retry' - через RETRY_DELAY,
+    None - больше не обходить
+    """
+    if status in ('success', 'no listings'):
+        return 'recrawl'
+    if status is None:
+        return 'retry'
+    return None
+
+
+def recrawl_interval_sql() -> str:
+    """Новый интервал события: умножается на RECRAWL_SHRINK, если листинги изменились,
+    и на RECRAWL_GROW, если нет. Без доли изменений (первый обход, ошибка) не меняется.
+    """
+    scheduler = settings.scheduler
+    return f"""LEAST({scheduler.recrawl_max}, GREATEST({scheduler.recrawl_min},
+        COALESCE(recrawl_interval, {scheduler.recrawl_interval})
+        * CASE WHEN %s IS NULL THEN 1 WHEN %s > 0 THEN {scheduler.recrawl_shrink} ELSE {scheduler.recrawl_grow} END
+    ))"""
+
+
+def finish_events(db: Db, outcomes: list[tuple]) -> None:
+    """Записывает исход обхода, пересчитывает интервал и время следующего обхода. Коммит за вызывающим кодом.
+    outcomes: [(task_id, owner, status, change_fraction)], change_fraction - доля изменившихся
+    листингов или None, если сравнивать было не с чем.
+    """
+    alpha = settings.scheduler.change_alpha
+    # MySQL применяет SET слева направо: next_due_at видит уже новый recrawl_interval
+    db.execute(f"""
+        UPDATE {db.table_events}
+        SET status=%s, last_outcome=%s, last_scraped_at=NOW(),
+            change_rate = COALESCE(change_rate * {1 - alpha} + {alpha} * %s, change_rate),
+            recrawl_interval = {recrawl_interval_sql()},
+            next_due_at = CASE %s
+                WHEN 'recrawl' THEN NOW() + INTERVAL recrawl_interval SECOND
+                WHEN 'retry' THEN NOW() + INTERVAL {settings.scheduler.retry_delay} SECOND
+            END
+        WHERE id=%s AND lease_owner=%s
+    """, [(status, status or 'failed', change_fraction, change_fraction, change_fraction, next_due(status), task_id, owner)
+          for task_id, owner, status, change_fraction in outcomes if task_id], many=True)
+
+
+class EventScheduler(Db):
+    def supersede_duplicates(self) -> int:
+        """Расписание ведётся по event_id: у события должна быть одна строка в очереди.
+        Более старые строки того же события (остались от ежедневных вставок до планировщика)
+        помечаются 'superseded' и больше не обходятся и не возвращаются в очередь.
+        """
+        self.insert(f"""
+            UPDATE {self.table_events} e
+            JOIN (
+                SELECT event_id, MAX(id) AS latest_id FROM {self.table_events}
+                GROUP BY event_id HAVING COUNT(*) > 1
+            ) latest ON latest.event_id = e.event_id AND e.id < latest.latest_id
+            SET e.status='superseded', e.next_due_at=NULL
+            WHERE e.status IS NULL OR e.status <> 'processing'
+        """)
+        return self.cursor.rowcount
+
+    def requeue_due(self) -> int:
+        """Возвращает в очередь обойдённые события, у которых подошло время следующего обхода.
+        Прошедшие события не возвращаются. Строка события одна, поэтому task_name
+        переводится на сегодняшний без конфликта с уникальным ключом.
+        """
+        self.insert(f"""
+            UPDATE IGNORE {self.table_events}
+            SET status=NULL, task_name=%s, priority={priority_sql()}
+            WHERE status IN ('success', 'no listings') AND next_due_at <= NOW()
+            AND (event_date IS NULL OR event_date + {EVENT_DATE_GRACE} > NOW())
+        """, (datetime.now().strftime('%Y%m%d'),))
+        return self.cursor.rowcount
+
+    def reprioritize(self) -> int:
+        """Пересчитывает приоритет ожидающих событий - он растёт по мере приближения даты.
+        Идёт диапазонами id с коммитом после каждого и не трогает строки, где приоритет не изменился.
+        """
+        first_id, last_id = self.select(f"SELECT MIN(id), MAX(id) FROM {self.table_events} WHERE status IS NULL")[0]
+        if first_id is None:
+            return 0
+        priority = priority_sql()
+        updated = 0
+        for start in range(first_id, last_id + 1, REPRIORITIZE_CHUNK):
+            self.insert(f"""
+                UPDATE {self.table_events} SET priority={priority}
+                WHERE status IS NULL AND id BETWEEN %s AND %s AND ABS(priority - {priority}) > 0.0001
+            """, (start, start + REPRIORITIZE_CHUNK - 1))
+            updated += self.cursor.rowcount
+        return updated
+
+
+class SchedulerTask(PeriodicTask):
+    def __init__(self):
+        super().__init__('event-scheduler', settings.scheduler.interval)
+
+    def tick(self):
+        scheduler = EventScheduler()
+        try:
+            superseded = scheduler.supersede_duplicates()
+            requeued = scheduler.requeue_due()
+            scheduler.reprioritize()
+        finally:
+            scheduler.close_connection()
+        if superseded:
+            self.logger.info(f"Снято дублей событий: {superseded}")
+        if requeued:
+            self.logger.info(f"Возвращено в очередь по расписанию: {requeued}")
@@ -0,0 +1,329 @@
+import hashlib
+import queue
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from config.settings import settings
+from db.core import Db
+from db.bulk import bulk_load
+from db.scheduler import finish_events
+from utils.logger import Logger
+
+
+TICKET_COLUMNS = (
+    'event_id', 'listing_id', 'section_id', 'section_name_id', 'section_name_raw_id',
+    'row_name', 'seat_numbers', 'ticket_quantity_lots', 'ticket_quantity',
+    'value_score', 'quality_score', 'listing_notes',
+    'display_price_pre_checkout', 'all_in_price_pre_checkout',
+    'display_price_checkout', 'buyer_fee_checkout',
+    'other_fee_checkout', 'sales_tax_checkout', 'all_in_price_checkout',
+    'cache_time', 'task_name', 'scrape_date',
+)
+# change_type писатель добавляет сам: 'full' - полный снимок, в delta-режиме 'new'/'changed'/'removed'
+INSERT_COLUMNS = TICKET_COLUMNS + ('change_type',)
+
+# Поля, изменение которых считается изменением листинга (всё, кроме времени и задачи)
+HASHED_FIELDS = len(TICKET_COLUMNS) - 3
+
+INSERT_CHUNK_SIZE = 1000
+
+# rows - кортежи в порядке TICKET_COLUMNS (на месте section_*_id пока названия секций),
+# status - статус события после записи
+TicketJob = namedtuple('TicketJob', ['task_id', 'owner', 'event_id', 'task_name', 'rows', 'status'])
+
+
+class WriterStopped(RuntimeError):
+    """Поток писателя не работает - листинги в очередь больше не примутся"""
+
+
+class SectionCache:
+    """Кэш названий секций -> id в таблице-справочнике, общий для процесса"""
+
+    def __init__(self):
+        self.ids = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, db: Db, names: set) -> dict:
+        with self.lock:
+            missing = [name for name in names if name not in self.ids]
+            if missing:
+                db.execute(f"INSERT IGNORE INTO {db.table_sections} (name) VALUES (%s)",
+                           [(name,) for name in missing], many=True)
+                for i in range(0, len(missing), INSERT_CHUNK_SIZE):
+                    chunk = missing[i:i + INSERT_CHUNK_SIZE]
+                    db.execute(f"SELECT id, name FROM {db.table_sections} WHERE name IN ({', '.join(['%s'] * len(chunk))})",
+                               tuple(chunk))
+                    self.ids.update((name, section_id) for section_id, name in db.cursor.fetchall())
+                # Коммитим сразу: id секций не должны пропасть при откате вставки листингов
+                db.connection.commit()
+            return self.ids
+
+
+section_cache = SectionCache()
+
+
+def resolve_sections(db: Db, rows: list[tuple]) -> list[tuple]:
+    """Заменяет названия секций в строках на id из справочника"""
+    names = {name for row in rows for name in row[3:5] if name}
+    if not names:
+        return rows
+    ids = section_cache.resolve(db, names)
+    return [row[:3] + (ids.get(row[3]), ids.get(row[4])) + row[5:] for row in rows]
+
+
+def listing_hash(row: tuple) -> bytes:
+    return hashlib.blake2b(repr(row[:HASHED_FIELDS]).encode(), digest_size=8).digest()
+
+
+def removed_row(event_id, listing_id, task_name: str, now: datetime) -> tuple:
+    row = [None] * len(TICKET_COLUMNS)
+    row[0], row[1] = event_id, listing_id
+    row[-3:] = now, task_name, now.date()
+    return tuple(row)
+
+
+def refresh_before(today: date) -> date | None:
+    """Неизменный листинг, последняя строка которого записана не позже этой даты, пишется заново
+    полным снимком ('full'): иначе после удаления партиции по TICKETS_RETENTION_DAYS
+    delta-история его потеряет, хотя хэш останется. None - партиции не удаляются.
+    """
+    tickets = settings.tickets
+    if not tickets.partitioned or tickets.retention_days <= 0:
+        return None
+    days = max(1, min(tickets.delta_refresh_days, tickets.retention_days - 1))
+    return today - timedelta(days=days)
+
+
+def diff_listings(db: Db, jobs: list[TicketJob]) -> tuple[list, list, list, dict]:
+    """Сравнивает листинги с последними сохранёнными хэшами событий.
+    Возвращает строки для вставки с типом изменения, хэши для upsert, удалённые (event_id, listing_id)
+    и долю изменившихся листингов по task_id (None, если сравнивать было не с чем).
+    """
+    event_ids = list({str(job.event_id) for job in jobs})
+    previous = {}
+    db.execute(f"""
+        SELECT event_id, listing_id, listing_hash, written_at FROM {db.table_listing_hashes}
+        WHERE event_id IN ({', '.join(['%s'] * len(event_ids))})
+    """, tuple(event_ids))
+    for event_id, listing_id, hash_value, written_at in db.cursor.fetchall():
+        previous.setdefault(str(event_id), {})[listing_id] = (bytes(hash_value), written_at)
+
+    now = datetime.utcnow().replace(microsecond=0)
+    refresh_date = refresh_before(now.date())
+    rows, upserts, removed, changes = [], [], [], {}
+    for job in jobs:
+        event_id = str(job.event_id)
+        seen = previous.pop(event_id, {})
+        known = len(seen)
+        changed = 0
+        for row in job.rows:
+            listing_id = str(row[1])
+            hash_value = listing_hash(row)
+            old_hash, written_at = seen.pop(listing_id, (None, None))
+            if old_hash == hash_value:
+                if refresh_date and written_at <= refresh_date:
+                    rows.append(row + ('full',))
+                    upserts.append((event_id, listing_id, hash_value, row[-1]))
+                continue
+            changed += 1
+            rows.append(row + ('new' if old_hash is None else 'changed',))
+            upserts.append((event_id, listing_id, hash_value, row[-1]))
+        for listing_id in seen:
+            rows.append(removed_row(event_id, listing_id, job.task_name, now) + ('removed',))
+            removed.append((event_id, listing_id))
+        changed += len(seen)
+        changes[job.task_id] = changed / max(known, len(job.rows)) if known else None
+    return rows, upserts, removed, changes
+
+
+def write_current_listings(db: Db, jobs: list[TicketJob], rows: list[tuple], removed: list) -> None:
+    """Поддерживает seatgeek_listings_current - последнее состояние каждого листинга.
+    rows - уже подготовленные к вставке строки (с change_type), removed - пропавшие листинги в delta-режиме
+    """
+    update = ', '.join(f"{column} = VALUES({column})" for column in TICKET_COLUMNS[2:])
+    sql = f"""
+        INSERT INTO {db.table_listings_current} ({', '.join(TICKET_COLUMNS)})
+        VALUES ({', '.join(['%s'] * len(TICKET_COLUMNS))})
+        ON DUPLICATE KEY UPDATE {update}
+    """
+    current = [row[:-1] for row in rows if row[-1] != 'removed' and row[1] is not None]
+    for i in range(0, len(current), INSERT_CHUNK_SIZE):
+        db.execute(sql, current[i:i + INSERT_CHUNK_SIZE], many=True)
+    if settings.tickets.delta_mode:
+        db.execute(f"DELETE FROM {db.table_listings_current} WHERE event_id=%s AND listing_id=%s",
+                   removed, many=True)
+        return
+    # Полный снимок: всё, что не пришло в этом ответе, осталось со старым cache_time
+    stale = []
+    for job in jobs:
+        if job.rows:
+            stale.append((job.event_id, min(row[-3] for row in job.rows)))
+        else:
+            stale.append((job.event_id, datetime.max))
+    db.execute(f"DELETE FROM {db.table_listings_current} WHERE event_id=%s AND cache_time < %s",
+               stale, many=True)
+
+
+def write_tickets(db: Db, jobs: list[TicketJob], history_only: bool = False) -> int:
+    """Записывает листинги нескольких событий и их статусы одной транзакцией.
+    history_only - только полные снимки в seatgeek_tickets: хэши листингов, seatgeek_listings_current
+    и статусы событий не трогаются (загрузка старых ответов не должна откатывать текущее состояние)
+    """
+    sql = f"""
+        INSERT INTO {db.table_tickets} ({', '.join(INSERT_COLUMNS)})
+        VALUES ({', '.join(['%s'] * len(INSERT_COLUMNS))})
+    """
+    delta_mode = settings.tickets.delta_mode and not history_only
+    # Хэши нужны и планировщику - по ним считается, как часто меняются листинги события
+    track_changes = not history_only and (delta_mode or settings.scheduler.enabled)
+    upserts, removed, changes = [], [], {}
+    if track_changes:
+        rows, upserts, removed, changes = diff_listings(db, jobs)
+    if not delta_mode:
+        rows = [row + ('full',) for job in jobs for row in job.rows]
+    rows = resolve_sections(db, rows)
+    try:
+        if rows and not (settings.db.bulk_load and bulk_load(db, db.table_tickets, INSERT_COLUMNS, rows)):
+            for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+                db.execute(sql, rows[i:i + INSERT_CHUNK_SIZE], many=True)
+        if track_changes:
+            db.execute(f"""
+                INSERT INTO {db.table_listing_hashes} (event_id, listing_id, listing_hash, written_at)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE listing_hash = VALUES(listing_hash), written_at = VALUES(written_at)
+            """, upserts, many=True)
+            db.execute(f"DELETE FROM {db.table_listing_hashes} WHERE event_id=%s AND listing_id=%s",
+                       removed, many=True)
+        if not history_only:
+            if settings.tickets.current_table:
+                write_current_listings(db, jobs, rows, removed)
+            finish_events(db, [(job.task_id, job.owner, job.status, changes.get(job.task_id)) for job in jobs])
+        db.connection.commit()
+    except Exception:
+        db.connection.rollback()
+        raise
+    return len(rows)
+
+
+class TicketWriter(threading.Thread):
+    """Пишет листинги в MySQL в отдельном потоке, чтобы браузер не ждал коммита.
+    Копит события из очереди и сбрасывает их, когда набралось batch_rows
+    листингов или прошло flush_interval секунд с первого события в пачке.
+    Очередь ограничена: если MySQL не успевает, submit() блокирует воркеров.
+    Соединение с MySQL берётся при сбросе пачки и переподключается после ошибок,
+    так что недоступная при старте база не убивает поток.
+    """
+
+    def __init__(self, max_retries: int = 3):
+        super().__init__(name='ticket-writer', daemon=True)
+        self.logger = Logger().get_logger(__name__)
+        self.queue = queue.Queue(maxsize=settings.writer.queue_size)
+        self.batch_rows = settings.writer.batch_rows
+        self.flush_interval = settings.writer.flush_interval
+        self.max_retries = max_retries
+        self.db = None
+
+    def submit(self, job: TicketJob) -> None:
+        """Ставит событие в очередь. WriterStopped, если поток писателя завершился -
+        иначе воркер ждал бы места в очереди вечно
+        """
+        while True:
+            if not self.is_alive():
+                raise WriterStopped("Поток записи tickets не работает")
+            try:
+                self.queue.put(job, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self, timeout: float = None) -> None:
+        """Дописывает всё, что осталось в очереди, и останавливает поток"""
+        try:
+            self.submit(None)
+        except WriterStopped:
+            return
+        self.join(timeout)
+
+    def run(self):
+        pending = []
+        pending_rows = 0
+        deadline = None
+        try:
+            while True:
+                timeout = max(0, deadline - time.monotonic()) if pending else None
+                try:
+                    job = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    job = False
+                if job:
+                    if not pending:
+                        deadline = time.monotonic() + self.flush_interval
+                    pending.append(job)
+                    pending_rows += len(job.rows)
+                if pending and (not job or pending_rows >= self.batch_rows):
+                    self.flush(pending)
+                    pending = []
+                    pending_rows = 0
+                if job is None:
+                    break
+        finally:
+            if self.db:
+                self.db.close_connection()
+
+    def connect(self) -> Db:
+        if self.db is None:
+            self.db = Db()
+        return self.db
+
+    def disconnect(self) -> None:
+        if self.db:
+            self.db.close_connection()
+            self.db = None
+
+    def flush(self, jobs: list[TicketJob]) -> None:
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                total = write_tickets(self.connect(), jobs)
+                print(f'  Вставлено {total} листингов ({len(jobs)} событий)')
+                return
+            except Exception as ex:
+                self.logger.error(f"Ошибка вставки tickets (попытка {attempt}): {ex}")
+                # Следующая попытка - с новым соединением
+                self.disconnect()
+                time.sleep(2 ** attempt)
+        if len(jobs) == 1:
+            self.fail(jobs)
+            return
+        # Одно событие, которое сервер не принимает, не должно тянуть за собой всю пачку
+        self.logger.warning(f"Пачка из {len(jobs)} событий не записана, записываю по одному")
+        for job in jobs:
+            try:
+                write_tickets(self.connect(), [job])
+            except Exception as ex:
+                self.logger.error(f"Листинги события {job.event_id} не записаны: {ex}")
+                self.disconnect()
+                self.fail([job])
+
+    def fail(self, jobs: list[TicketJob]) -> None:
+        """Отмечает обход событий неудачным: они вернутся в очередь через RETRY_DELAY с пониженным приоритетом,
+        а не сразу - иначе тот же ответ снова сломал бы следующую пачку
+        """
+        try:
+            db = self.connect()
+            finish_events(db, [(job.task_id, job.owner, None, None) for job in jobs])
+            db.connection.commit()
+        except Exception as ex:
+            self.logger.error(f"Ошибка записи статуса событий: {ex}")
+            self.disconnect()
+            self.requeue(jobs)
+
+    def requeue(self, jobs: list[TicketJob]) -> None:
+        """Возвращает в очередь события, листинги которых так и не удалось записать"""
+        try:
+            db = self.connect()
+            db.insert_many(
+                f"UPDATE {db.table_events} SET status=NULL WHERE id=%s AND lease_owner=%s",
+                [(job.task_id, job.owner) for job in jobs if job.task_id])
+        except Exception as ex:
+            self.logger.error(f"Ошибка возврата событий в очередь: {ex}")
@@ -0,0 +1,95 @@
+import base64
+import itertools
+import json
+import threading
+import requests
+import websocket
+
+
+class CdpCapture:
+    """Ловит ответ API по событиям DevTools через отдельное соединение с вкладкой:
+    без mitmproxy, без хранения всех запросов в памяти и без опроса driver.requests.
+    """
+
+    def __init__(self, debugger_address: str, url_part: str = '/api/event_listings_v2', timeout: int = 10):
+        self.url_part = url_part
+        self.timeout = timeout
+        self.ids = itertools.count(1)
+        self.waiters = {}
+        self.results = {}
+        self.pending = set()
+        self.request_id = None
+        self.found = threading.Event()
+        targets = requests.get(f"http://{debugger_address}/json", timeout=timeout).json()
+        page = next(target for target in targets if target['type'] == 'page')
+        # Chrome отклоняет websocket с чужим Origin без --remote-allow-origins
+        self.ws = websocket.create_connection(page['webSocketDebuggerUrl'], suppress_origin=True)
+        self.thread = threading.Thread(target=self.listen, name='cdp-capture', daemon=True)
+        self.thread.start()
+        self.call('Network.enable')
+
+    def listen(self):
+        while True:
+            try:
+                message = json.loads(self.ws.recv())
+            except (websocket.WebSocketException, OSError, ValueError):
+                break
+            if 'id' in message:
+                self.results[message['id']] = message
+                waiter = self.waiters.pop(message['id'], None)
+                if waiter:
+                    waiter.set()
+                continue
+            method = message.get('method')
+            params = message.get('params', {})
+            if method == 'Network.responseReceived':
+                response = params.get('response', {})
+                if self.url_part in response.get('url', '') and response.get('status') == 200:
+                    self.pending.add(params['requestId'])
+            elif method == 'Network.loadingFinished' and params.get('requestId') in self.pending:
+                self.request_id = params['requestId']
+                self.found.set()
+        for waiter in list(self.waiters.values()):
+            waiter.set()
+
+    def call(self, method: str, params: dict = None) -> dict:
+        call_id = next(self.ids)
+        waiter = self.waiters[call_id] = threading.Event()
+        self.ws.send(json.dumps({'id': call_id, 'method': method, 'params': params or {}}))
+        if not waiter.wait(self.timeout):
+            self.waiters.pop(call_id, None)
+            raise TimeoutError(f"CDP {method}: нет ответа за {self.timeout} с")
+        message = self.results.pop(call_id, None)
+        if message is None:
+            raise ConnectionError(f"CDP {method}: соединение закрыто")
+        if 'error' in message:
+            raise RuntimeError(f"CDP {method}: {message['error'].get('message')}")
+        return message.get('result', {})
+
+    def reset(self):
+        """Вызывать перед загрузкой новой страницы"""
+        self.pending.clear()
+        self.request_id = None
+        self.found.clear()
+
+    def is_alive(self) -> bool:
+        """Соединение с DevTools живо: после его разрыва поток чтения завершается и ответы больше не ловятся"""
+        return self.thread.is_alive()
+
+    def wait(self, timeout: float) -> bool:
+        return self.found.wait(timeout)
+
+    def body(self) -> bytes | None:
+        """Тело пойманного ответа или None, если он ещё не пришёл целиком"""
+        if not self.found.is_set():
+            return None
+        result = self.call('Network.getResponseBody', {'requestId': self.request_id})
+        if result.get('base64Encoded'):
+            return base64.b64decode(result['body'])
+        return result['body'].encode('utf-8')
+
+    def close(self):
+        try:
+            self.ws.close()
+        except Exception:
+            pass
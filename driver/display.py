@@ -0,0 +1,122 @@
+import os
+import shutil
+import subprocess
+import sys
+import time
+from config.settings import settings
+from utils.logger import Logger
+from utils.periodic import PeriodicTask
+
+
+class VirtualDisplay:
+    """Xvfb на фиксированном номере: после перезапуска браузеры находят его по тому же DISPLAY"""
+
+    def __init__(self, number: int):
+        self.number = number
+        self.process = None
+
+    @property
+    def name(self) -> str:
+        return f":{self.number}"
+
+    @property
+    def socket_path(self) -> str:
+        return f"/tmp/.X11-unix/X{self.number}"
+
+    def start(self, timeout: float = 10) -> None:
+        # Xvfb, убитый без остановки, оставляет lock-файл и не даёт занять номер снова
+        for path in (f"/tmp/.X{self.number}-lock", self.socket_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.process = subprocess.Popen(
+            ['Xvfb', self.name, '-screen', '0', f"{settings.displays.size}x24", '-nolisten', 'tcp'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + timeout
+        while not self.is_healthy():
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.stop()
+                raise RuntimeError(f"Xvfb {self.name} не запустился")
+            time.sleep(0.1)
+
+    def is_healthy(self) -> bool:
+        return self.process is not None and self.process.poll() is None and os.path.exists(self.socket_path)
+
+    def stop(self) -> None:
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+
+class DisplayManager:
+    """Запускает DISPLAY_COUNT серверов Xvfb один раз на всё приложение и раздаёт их номера браузерам.
+    Если Xvfb недоступен или DISPLAY_MODE=headless, браузеры запускаются в headless-режиме.
+    """
+
+    def __init__(self, count: int = None):
+        self.count = settings.displays.count if count is None else count
+        self.logger = Logger().get_logger(__name__)
+        self.displays = []
+        self.headless = settings.displays.mode == 'headless'
+
+    def start(self) -> None:
+        if sys.platform != 'linux' or self.headless:
+            return
+        if not shutil.which('Xvfb'):
+            self.logger.warning("Xvfb не найден, браузеры будут запускаться в headless-режиме")
+            self.headless = True
+            return
+        for index in range(self.count):
+            display = VirtualDisplay(settings.displays.base + index)
+            try:
+                display.start()
+                self.displays.append(display)
+            except Exception as ex:
+                self.logger.error(f"Не удалось запустить дисплей {display.name}: {ex}")
+        if not self.displays:
+            self.logger.warning("Ни один дисплей не запустился, браузеры будут запускаться в headless-режиме")
+            self.headless = True
+
+    def assign(self, index: int) -> str | None:
+        """DISPLAY для воркера index, 'headless' или None, если дисплей не нужен (не linux)"""
+        if self.headless:
+            return 'headless'
+        if not self.displays:
+            return None
+        return self.displays[index % len(self.displays)].name
+
+    def check(self) -> None:
+        """Перезапускает упавшие дисплеи на тех же номерах"""
+        for display in self.displays:
+            if display.is_healthy():
+                continue
+            self.logger.warning(f"Дисплей {display.name} не отвечает, перезапускаю")
+            display.stop()
+            try:
+                display.start()
+            except Exception as ex:
+                self.logger.error(f"Не удалось перезапустить дисплей {display.name}: {ex}")
+
+    def stop(self) -> None:
+        for display in self.displays:
+            display.stop()
+
+
+class DisplayHealthTask(PeriodicTask):
+    def __init__(self, manager: DisplayManager):
+        super().__init__('display-health', settings.displays.check_interval)
+        self.manager = manager
+
+    def tick(self):
+        self.manager.check()
+
+
+def use_display(display: str | None) -> None:
+    """Направляет браузеры текущего процесса на выданный DisplayManager дисплей"""
+    if display == 'headless':
+        settings.displays.mode = 'headless'
+    elif display:
+        os.environ['DISPLAY'] = display
@@ -1,10 +1,14 @@
 import os
 import uuid
+import hashlib
+import shutil
 import random
 import json
 import logging
 import sys
+import undetected_chromedriver as uc_webdriver
 from seleniumwire import undetected_chromedriver as uc_webdriver_wire
+from config.settings import settings
 from dotenv import load_dotenv
 from utils.func import load_from_file_json
 from proxies.proxy_ext import load_proxy
@@ -19,15 +23,27 @@ _original_stderr = sys.stderr
 
 load_dotenv(override=True)
 
+# Что не переносить из шаблона профиля: блокировки запущенного Chrome и кэши
+TEMPLATE_IGNORE = shutil.ignore_patterns('Singleton*', 'Cache', 'Code Cache', 'GPUCache',
+                                         'ShaderCache', 'GrShaderCache', 'Crashpad', 'proxy_ext')
+
+
 class ChromeWebDriver:
-    def create_driver(self, first_run: bool = False):
+    def create_driver(self, first_run: bool = False, template_dir: str = None, profile_dir: str = None):
+        """template_dir - готовый профиль, который копируется вместо создания нового,
+        profile_dir - где держать профиль вместо chrome_data/<uuid>
+        """
         profile_id = str(uuid.uuid4())
         self.first_run = first_run
-        self.folder_temp = f"{os.path.abspath('chrome_data')}/{profile_id}"
+        self.capture_mode = settings.capture.mode
+        self.folder_temp = profile_dir or f"{os.path.abspath('chrome_data')}/{profile_id}"
         proxies_list = load_from_file_json('proxies/proxies_list.json')
         random.shuffle(proxies_list)
         self.current_proxy = proxies_list[0]
-        self._force_en_locale()
+        if template_dir and os.path.isdir(template_dir):
+            shutil.copytree(template_dir, self.folder_temp, ignore=TEMPLATE_IGNORE)
+        else:
+            self._force_en_locale()
         os.makedirs(self.folder_temp, exist_ok=True)
         self._set_chrome_options()
         self._create_chromedriver()
@@ -35,7 +51,13 @@ class ChromeWebDriver:
 
     def _create_chromedriver(self):
         driver_version = os.getenv("DRIVER_VERSION", 135)
-        if sys.platform != 'linux': 
+        if self.capture_mode == 'cdp':
+            # Без selenium-wire: прокси через расширение, ответы API ловит CdpCapture
+            self.driver = uc_webdriver.Chrome(version_main=int(driver_version),
+                                              user_data_dir=self.folder_temp,
+                                              user_multi_procs=not self.first_run,
+                                              options=self.options)
+        elif sys.platform != 'linux': 
             proxy = {
                 'http':self.current_proxy,
                 'https':self.current_proxy
@@ -82,6 +104,9 @@ class ChromeWebDriver:
                                             user_multi_procs=True,
                                             options=self.options)
 
+        if self.capture_mode != 'cdp':
+            # selenium-wire сохраняет только ответы API, остальные запросы проходят без записи
+            self.driver.scopes = settings.capture.scopes
         
         self.driver.set_page_load_timeout(60)
         
@@ -95,6 +120,9 @@ class ChromeWebDriver:
         except:
             pass
         self.driver.execute_cdp_cmd("Network.enable", {})
+        if settings.capture.blocked_urls:
+            # Шрифты, медиа и аналитика не нужны для ответа API - не грузим их через прокси
+            self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": settings.capture.blocked_urls})
         self.driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
             "source": """
                 Object.defineProperty(navigator, 'language', {
@@ -121,11 +149,13 @@ class ChromeWebDriver:
 
     def _set_chrome_options(self):
         self.options = uc_webdriver_wire.ChromeOptions()
-        if sys.platform == 'linux':
+        if sys.platform == 'linux' or self.capture_mode == 'cdp':
             extensions = []
-            proxy_extension_path = load_proxy(self.current_proxy, self.folder_temp)
+            proxy_extension_path = self._proxy_extension()
             extensions.append(proxy_extension_path)
             self.options.add_argument(f"--load-extension={','.join(extensions)}")
+        if settings.displays.mode == 'headless':
+            self.options.add_argument('--headless=new')
         self.options.add_argument("--lang=en-US")
         self.options.add_argument("--accept-language=en-US,en;q=0.9")
         self.options.add_argument("--intl.accept_languages=en-US,en;q=0.9")
@@ -151,6 +181,27 @@ class ChromeWebDriver:
         self.options.add_experimental_option("prefs", prefs)
 
 
+    def _proxy_extension(self) -> str:
+        """Расширение прокси собирается один раз на прокси и переиспользуется всеми профилями.
+        Собирается во временном каталоге и переименовывается целиком: другой процесс воркера
+        не увидит наполовину записанный background.js
+        """
+        proxy_hash = hashlib.sha1(self.current_proxy.encode()).hexdigest()[:12]
+        extensions_root = os.path.join(os.path.abspath('chrome_data'), '_extensions')
+        extension_dir = os.path.join(extensions_root, proxy_hash)
+        extension_path = os.path.join(extension_dir, 'proxy_ext')
+        if os.path.exists(os.path.join(extension_path, 'background.js')):
+            return extension_path
+        os.makedirs(extensions_root, exist_ok=True)
+        temp_dir = os.path.join(extensions_root, f".{proxy_hash}-{uuid.uuid4().hex}")
+        load_proxy(self.current_proxy, temp_dir)
+        try:
+            os.rename(temp_dir, extension_dir)
+        except OSError:
+            # Другой процесс успел положить то же расширение
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        return extension_path
+
     def _force_en_locale(self):
         prefs_dir = os.path.join(self.folder_temp, "Default")
         os.makedirs(prefs_dir, exist_ok=True)
@@ -0,0 +1,180 @@
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from config.settings import settings
+from driver.dynamic import ChromeWebDriver
+from utils.logger import Logger
+
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def process_tree_rss(root_pids) -> int:
+    """Суммарный RSS процессов и всех их потомков в байтах, по /proc (только linux)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as file:
+                stat = file.read()
+        except OSError:
+            continue
+        # имя процесса в скобках может содержать пробелы, ppid - второе поле после него
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    total = 0
+    seen = set()
+    stack = [pid for pid in root_pids if pid]
+    while stack:
+        pid = stack.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        try:
+            with open(f'/proc/{pid}/statm') as file:
+                total += int(file.read().split()[1]) * PAGE_SIZE
+        except OSError:
+            continue
+        stack.extend(children.get(pid, []))
+    return total
+
+
+class Browser:
+    """Запущенный Chrome вместе с его профилем"""
+
+    def __init__(self, driver, folder_temp: str, proxy: str):
+        self.driver = driver
+        self.folder_temp = folder_temp
+        self.proxy = proxy
+        self.created_at = time.monotonic()
+        self.pages = 0
+
+    def is_alive(self) -> bool:
+        try:
+            self.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def rss(self) -> int:
+        """RSS chromedriver, Chrome и всех его процессов"""
+        if sys.platform != 'linux':
+            return 0
+        service = getattr(self.driver, 'service', None)
+        process = getattr(service, 'process', None)
+        return process_tree_rss([getattr(self.driver, 'browser_pid', None), getattr(process, 'pid', None)])
+
+    def recycle_reason(self) -> str | None:
+        """Почему браузер пора заменить, или None"""
+        # Ошибки WebDriver get_api_content не пробрасывает - упавший Chrome виден только здесь
+        if not self.is_alive():
+            return "браузер не отвечает"
+        limits = settings.browsers
+        if limits.max_pages and self.pages >= limits.max_pages:
+            return f"{self.pages} страниц"
+        age = time.monotonic() - self.created_at
+        if limits.max_age and age >= limits.max_age * 60:
+            return f"работает {int(age // 60)} мин"
+        if limits.max_rss_mb:
+            rss_mb = self.rss() // (1024 * 1024)
+            if rss_mb >= limits.max_rss_mb:
+                return f"RSS {rss_mb} МБ"
+        return None
+
+    def close(self):
+        try:
+            self.driver.quit()
+        except:
+            pass
+        # Chrome отпускает файлы профиля не сразу после quit
+        time.sleep(2)
+        shutil.rmtree(self.folder_temp, ignore_errors=True)
+
+
+class BrowserPool:
+    """Держит наготове pool_size запущенных Chrome с профилями из шаблона и выдаёт их потокам.
+    Отработавшие браузеры закрываются и удаляются в фоне, не задерживая поток.
+    """
+
+    def __init__(self, size: int = None):
+        self.size = settings.browsers.pool_size if size is None else size
+        self.template_dir = os.path.abspath(settings.browsers.template_dir)
+        self.logger = Logger().get_logger(__name__)
+        self.ready = queue.Queue()
+        self.retired = queue.Queue()
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.filler = threading.Thread(target=self.fill, name='browser-pool-fill', daemon=True)
+        self.cleaner = threading.Thread(target=self.cleanup, name='browser-pool-cleanup', daemon=True)
+
+    def start(self):
+        self.filler.start()
+        self.cleaner.start()
+
+    def launch(self) -> Browser:
+        driver, folder_temp, proxy = ChromeWebDriver().create_driver(template_dir=self.template_dir)
+        return Browser(driver, folder_temp, proxy)
+
+    def fill(self):
+        while not self.stop_event.is_set():
+            if self.ready.qsize() >= self.size:
+                self.wakeup.wait(1)
+                self.wakeup.clear()
+                continue
+            try:
+                self.ready.put(self.launch())
+            except Exception as ex:
+                self.logger.error(f"Не удалось запустить браузер для пула: {ex}")
+                self.stop_event.wait(5)
+
+    def acquire(self) -> Browser:
+        """Готовый браузер из пула; если пул пуст - запускается сразу в потоке вызывающего"""
+        try:
+            while True:
+                try:
+                    browser = self.ready.get_nowait()
+                except queue.Empty:
+                    return self.launch()
+                if browser.is_alive():
+                    return browser
+                self.release(browser)
+        finally:
+            self.wakeup.set()
+
+    def release(self, browser: Browser):
+        self.retired.put(browser)
+
+    def cleanup(self):
+        while True:
+            browser = self.retired.get()
+            if browser is None:
+                return
+            browser.close()
+
+    def close(self, timeout: float = 60):
+        self.stop_event.set()
+        self.wakeup.set()
+        self.filler.join(timeout)
+        while not self.ready.empty():
+            self.release(self.ready.get_nowait())
+        self.retired.put(None)
+        self.cleaner.join(timeout)
+
+
+def build_template(template_dir: str) -> None:
+    """Один раз запускает Chrome на пустом профиле, чтобы потом копировать уже инициализированный"""
+    template_dir = os.path.abspath(template_dir)
+    building_dir = f"{template_dir}.building"
+    shutil.rmtree(building_dir, ignore_errors=True)
+    driver, _, _ = ChromeWebDriver().create_driver(first_run=True, profile_dir=building_dir)
+    try:
+        driver.quit()
+    except:
+        pass
+    time.sleep(2)
+    shutil.rmtree(template_dir, ignore_errors=True)
+    os.rename(building_dir, template_dir)
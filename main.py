@@ -1,19 +1,20 @@
-import threading
-import os
 import sys
 from dotenv import load_dotenv
-import time
 from proxies.get_proxies import update_proxies
+from config.settings import settings
 from db.core import IsDbTable
+from db.lease import LeaseReaper
+from db.partitions import TicketPartitionsTask
+from db.scheduler import SchedulerTask
+from driver.display import DisplayHealthTask, DisplayManager, use_display
+from driver.pool import build_template
 from parser.get_tickets import GetTickets
 from parser.get_events import GetEvents
-from pyvirtualdisplay import Display
+from workers.supervisor import Supervisor
 
 
 load_dotenv(override=True)
 
-os.environ['PYVIRTUALDISPLAY_DISPLAYFD'] = '0'
-
 class StderrFilter:
     def __init__(self, original_stderr):
         self.original_stderr = original_stderr
@@ -30,62 +31,33 @@ class StderrFilter:
 sys.stderr = StderrFilter(sys.stderr)
 
 
-def run_worker(worker_id):
-    """Запускает GetTickets в отдельном потоке"""
-    try:
-        GetTickets().get()
-    except Exception as ex:
-        print(f"❌ Поток #{worker_id} ошибка: {ex}")
-
-
 def first_run():
-    from driver.dynamic import ChromeWebDriver
-    import shutil
-    display = None
+    """Первый запуск Chrome: патчит chromedriver и собирает шаблон профиля для остальных браузеров"""
     try:
-        if sys.platform == 'linux':
-            print('Open Dispay')
-            display = Display(visible=False)    
-            display.start()  
-        init_driver = ChromeWebDriver()
-        driver, folder_temp, proxy = init_driver.create_driver(first_run=True)
-        try:
-            driver.quit()
-        except:
-            pass
-        try:
-            time.sleep(2)
-            shutil.rmtree(folder_temp)
-        except:
-            pass
-        if display:
-            try:
-                display.stop()
-            except:
-                pass
-
+        build_template(settings.browsers.template_dir)
     except Exception as ex:
         print(f"⚠️ Ошибка инициализации: {ex}")
 
 def main():
-    first_run()
-    
-    num_threads = int(os.getenv("THREADS_COUNT", 10))
-    threads = []
-    
-    for i in range(1, num_threads + 1):
-        thread = threading.Thread(target=run_worker, args=(i,), daemon=True)
-        thread.start()
-        threads.append(thread)
-        time.sleep(2)  
-
+    displays = DisplayManager()
+    displays.start()
     try:
-        for thread in threads:
-            thread.join()
-        print("✅ Все потоки завершены!")
-    except KeyboardInterrupt:
-        print("\n⚠️ Получен сигнал остановки...")
-        print("⏳ Ожидание завершения активных потоков...")
+        use_display(displays.assign(0))
+        first_run()
+
+        DisplayHealthTask(displays).start()
+        reaper = LeaseReaper()
+        reaper.start()
+        if settings.tickets.partitioned:
+            TicketPartitionsTask().start()
+        if settings.scheduler.enabled:
+            scheduler = SchedulerTask()
+            # Приоритеты нужны до того, как воркеры начнут забирать события
+            scheduler.tick()
+            scheduler.start()
+        Supervisor(displays=displays).run()
+    finally:
+        displays.stop()
 
 
 if __name__ == "__main__":
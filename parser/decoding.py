@@ -0,0 +1,148 @@
+"""Разбор пойманного ответа event_listings_v2: сжатие определяется по Content-Encoding
+или сигнатуре, тело распаковывается один раз и сразу отдаётся JSON-парсеру как bytes,
+без промежуточной строки. Парсер - orjson или msgspec, если установлены, иначе json.
+"""
+import gzip
+import json
+import threading
+import zlib
+from datetime import datetime
+from typing import Any
+from config.settings import settings
+from parser.listings import listings_to_rows
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+_local = threading.local()
+
+
+def detect_encoding(body: bytes, content_encoding: str = None) -> str | None:
+    """gzip, br, zstd, deflate или None для несжатого тела"""
+    if content_encoding:
+        encoding = content_encoding.split(',')[-1].strip().lower()
+        if encoding in ('gzip', 'x-gzip', 'br', 'zstd', 'deflate'):
+            return 'gzip' if encoding == 'x-gzip' else encoding
+    if body[:2] == GZIP_MAGIC:
+        return 'gzip'
+    if body[:4] == ZSTD_MAGIC:
+        return 'zstd'
+    return None
+
+
+def zstd_decompressor():
+    """Декомпрессор zstd переиспользуется внутри потока - создавать его на каждый ответ дорого"""
+    decompressor = getattr(_local, 'zstd', None)
+    if decompressor is None:
+        decompressor = _local.zstd = zstandard.ZstdDecompressor()
+    return decompressor
+
+
+def decompress(body: bytes, content_encoding: str = None) -> bytes:
+    encoding = detect_encoding(body, content_encoding)
+    # Заголовок мог остаться от сжатого ответа, а тело уже распаковано (selenium-wire, CDP)
+    if encoding == 'gzip' and body[:2] == GZIP_MAGIC:
+        return gzip.decompress(body)
+    if encoding == 'zstd' and body[:4] == ZSTD_MAGIC and zstandard:
+        return zstd_decompressor().decompressobj().decompress(body)
+    if encoding == 'br' and brotli:
+        try:
+            return brotli.decompress(body)
+        except brotli.error:
+            return body
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return body
+    return body
+
+
+def loads(data: bytes) -> Any:
+    if orjson:
+        return orjson.loads(data)
+    if msgspec:
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+
+def decode_payload(body: bytes, content_encoding: str = None) -> Any:
+    return loads(decompress(body, content_encoding))
+
+
+if msgspec:
+    class Listing(msgspec.Struct):
+        """Только те поля листинга, что попадают в seatgeek_tickets; остальные msgspec пропускает"""
+        e: Any = None
+        id: Any = None
+        s: Any = None
+        sf: Any = None
+        sr: Any = None
+        r: Any = None
+        ss: Any = None
+        q: Any = None
+        dq: Any = None
+        ptd: Any = None
+        p: Any = None
+        pf: Any = None
+        dp: Any = None
+        f: Any = None
+
+        def get(self, name, default=None):
+            # listings_to_rows обращается к листингу как к словарю
+            return getattr(self, name, default)
+
+    # Верхний уровень разбирается лениво (Raw): пустой ответ отличается от ответа без листингов
+    # так же, как в разборе через словари, а сам массив разбирается сразу в структуры
+    _payload_decoder = msgspec.json.Decoder(dict[str, msgspec.Raw])
+    _listings_decoder = msgspec.json.Decoder(list[Listing | None] | None)
+
+
+def decode_typed_rows(data: bytes, task_name: str, cache_time: datetime = None) -> list[tuple] | None:
+    payload = _payload_decoder.decode(data)
+    if not payload:
+        return None
+    raw = payload.get('listings')
+    listings = _listings_decoder.decode(raw) if raw else None
+    return listings_to_rows(listings or [], task_name, cache_time)
+
+
+def decode_listing_rows(body: bytes, task_name: str, content_encoding: str = None,
+                        cache_time: datetime = None) -> list[tuple] | None:
+    """Строки для seatgeek_tickets из тела ответа. None - ответ пустой.
+    С msgspec и CAPTURE_TYPED_LISTINGS листинги разбираются сразу в структуры, минуя словари.
+    cache_time - время снимка, если ответ получен не сейчас (повтор из архива).
+    """
+    data = decompress(body, content_encoding)
+    if msgspec and settings.capture.typed_listings:
+        try:
+            return decode_typed_rows(data, task_name, cache_time)
+        except msgspec.ValidationError:
+            # Листинг не того вида, что ждёт структура - разбираем через словари,
+            # там плохие листинги пропускаются поштучно
+            pass
+    payload = loads(data)
+    if not payload:
+        return None
+    return listings_to_rows(payload.get('listings') or [], task_name, cache_time)
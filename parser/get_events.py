@@ -1,90 +1,248 @@
 import requests
 import random
-from bs4 import BeautifulSoup
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from requests.adapters import HTTPAdapter
+from config.settings import settings
 from db.core import Db
+from db.bulk import bulk_load
+from parser.sitemap import iter_sitemap
 from utils.func import load_from_file_json
 from utils.logger import Logger
 from datetime import datetime
 
 
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "Accept": "*/*",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Referer": "https://www.google.com/",
+    "Connection": "keep-alive"
+}
+
+# .../toronto-rogers-centre-2024-11-14-7-30-pm/concert/6110187
+EVENT_DATE_RE = re.compile(r'-(\d{4})-(\d{2})-(\d{2})(?:-(\d{1,2})(?:-(\d{2}))?-(am|pm))?/')
+
+
 class GetEvents:
     def __init__(self):
         self.logger = Logger().get_logger(__name__)
         self.proxies_list = load_from_file_json('proxies/proxies_list.json')
+        self.local = threading.local()
 
-    def get(self):
+    def get(self, full_refresh: bool = None):
+        """Инкрементальный обход: sitemap с прежним lastmod не скачиваются, остальные -
+        условным GET (If-None-Match/If-Modified-Since), в очередь ставятся только новые
+        и изменившиеся события. full_refresh=True - полный проход, как раньше.
+        """
+        if full_refresh is None:
+            full_refresh = settings.discovery.full_refresh
         task_name = datetime.now().strftime('%Y%m%d')
         url = 'https://seatgeek.com/sitemap/events.xml'
-        content = self.get_page_response(url)
-        if not content:
+        response = self.get_page_response(url)
+        if response is None:
             return
-        links = self.get_links(content)
-        if not links:
+        sitemaps = self.get_links(response.content)
+        if not sitemaps:
             self.logger.critical(f'There are not links from sitemap')
             return
-        for idx, link in enumerate(links, 1):
-            print(f"\nОбработка sitemap {idx}/{len(links)}: {link}")
-            content = self.get_page_response(link)
-            if content:
-                event_urls = self.get_links(content)
-                if not event_urls:
-                    self.logger.critical(f'There are not event URLs from sitemap {link}')
+        db = Db()
+        cache = {} if full_refresh else self.load_sitemap_cache(db)
+        changed = [entry for entry in sitemaps
+                   if not entry.lastmod or cache.get(entry.loc, {}).get('lastmod') != entry.lastmod]
+        print(f"Sitemap без изменений: {len(sitemaps) - len(changed)}, к обработке: {len(changed)}")
+        for idx, (entry, response) in enumerate(self.fetch_all(changed, cache), 1):
+            print(f"\nОбработка sitemap {idx}/{len(changed)}: {entry.loc}")
+            if response is None:
+                continue
+            if response.status_code == 304:
+                print("  Не изменился (304)")
+            else:
+                total, failed = self.insert_events(iter_sitemap(response.content), task_name, full_refresh)
+                if not total:
+                    self.logger.critical(f'There are not event URLs from sitemap {entry.loc}')
+                    continue
+                if failed:
+                    # Без сохранённого lastmod sitemap будет обработан заново при следующем обходе
+                    self.logger.error(f"Sitemap {entry.loc}: не записано батчей - {failed}, кэш не обновлён")
                     continue
-                self.insert_events(event_urls, task_name)
+            self.save_sitemap_cache(db, entry, response)
+        db.close_connection()
 
+    def fetch_all(self, entries: list, cache: dict):
+        """Скачивает sitemap параллельно и отдаёт (entry, response) по мере готовности.
+        В работе не больше 2 * concurrency ссылок, чтобы скачанное не копилось, пока идёт вставка.
+        """
+        concurrency = settings.discovery.concurrency
+        entries_iter = iter(entries)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = {}
+            while True:
+                for entry in islice(entries_iter, 2 * concurrency - len(pending)):
+                    headers = self.conditional_headers(cache.get(entry.loc))
+                    pending[executor.submit(self.get_page_response, entry.loc, headers)] = entry
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
 
-    def insert_events(self, event_urls: list, task_name: str):
-        if not event_urls:
-            print("  Нет URL для вставки")
-            return
+    def conditional_headers(self, cached: dict | None) -> dict:
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+        return headers
+
+    def load_sitemap_cache(self, db: Db) -> dict:
+        rows = db.select(f"SELECT url, etag, last_modified, lastmod FROM {db.table_sitemaps}")
+        return {url: {'etag': etag, 'last_modified': last_modified, 'lastmod': lastmod}
+                for url, etag, last_modified, lastmod in rows}
+
+    def save_sitemap_cache(self, db: Db, entry, response: requests.Response) -> None:
+        db.insert(f"""
+            INSERT INTO {db.table_sitemaps} (url, etag, last_modified, lastmod, checked_at)
+            VALUES (%s, %s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE
+                etag = COALESCE(VALUES(etag), etag),
+                last_modified = COALESCE(VALUES(last_modified), last_modified),
+                lastmod = VALUES(lastmod),
+                checked_at = VALUES(checked_at)
+        """, (entry.loc, response.headers.get('ETag'), response.headers.get('Last-Modified'), entry.lastmod))
+
+    def insert_events(self, entries, task_name: str, full_refresh: bool = True) -> tuple[int, int]:
+        """Вставляет события из потока SitemapEntry пачками, не собирая весь sitemap в память.
+        Без full_refresh в очередь попадают только события, которых ещё не было или у которых сменился lastmod.
+        Возвращает (сколько URL прочитано, сколько батчей не удалось записать).
+        """
         db = Db()
+        entries = iter(entries)
         batch_size = 10000
-        total_batches = (len(event_urls) + batch_size - 1) // batch_size
-
-        for batch_num in range(total_batches):
-            start_idx = batch_num * batch_size
-            end_idx = min(start_idx + batch_size, len(event_urls))
-            batch = event_urls[start_idx:end_idx]
-            values_list = []
-            for url in batch:
-                event_id = url.rstrip('/').split('/')[-1]
-                values_list.append((event_id, url, task_name))
+        total = 0
+        enqueued = 0
+        batch_num = 0
+        failed = 0
+        while True:
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                break
+            batch_num += 1
+            total += len(batch)
             try:
-                sql = f"""
-                    INSERT IGNORE INTO {db.table_events} (event_id, event_url, task_name) 
-                    VALUES (%s, %s, %s)
-                """
-                db.cursor.executemany(sql, values_list)
-                db.connection.commit()
+                if not full_refresh:
+                    batch = self.filter_changed(db, batch)
+                self.enqueue_events(db, batch, task_name)
+                enqueued += len(batch)
             except Exception as ex:
-                print(f"  Ошибка в батче {batch_num + 1}: {ex}")
+                db.connection.rollback()
+                failed += 1
+                print(f"  Ошибка в батче {batch_num}: {ex}")
         db.close_connection()
-        print(f"  Всего обработано URL: {len(event_urls)}")
-            
-    def get_links(self, content: str) -> list:
-        xml = BeautifulSoup(content, 'lxml-xml')
-        lists = set()
-        for loc in xml.find_all("loc"):
-            lists.add(loc.text)
-        return list(lists)
-
-    def get_page_response(self, url: str, count_retry: int = 0) -> str:
-        if count_retry > 3:
-            self.logger.critical(f'There is not page content from link {url}')
+        print(f"  Всего обработано URL: {total}, поставлено в очередь: {enqueued}")
+        return total, failed
+
+    def filter_changed(self, db: Db, batch: list) -> list:
+        event_ids = [self.event_id(entry.loc) for entry in batch]
+        db.execute(f"""
+            SELECT event_id, lastmod FROM {db.table_event_urls}
+            WHERE event_id IN ({', '.join(['%s'] * len(event_ids))})
+        """, tuple(event_ids))
+        known = dict(db.cursor.fetchall())
+        return [entry for event_id, entry in zip(event_ids, batch)
+                if event_id not in known or (entry.lastmod and entry.lastmod != known[event_id])]
+
+    def enqueue_events(self, db: Db, batch: list, task_name: str) -> None:
+        if not batch:
+            return
+        all_rows = [(self.event_id(entry.loc), entry.loc, task_name, self.event_date(entry.loc)) for entry in batch]
+        rows = all_rows
+        if settings.scheduler.enabled:
+            # С планировщиком у события одна строка: её интервал и частота изменений сохраняются
+            rows = self.requeue_known(db, all_rows, task_name)
+        columns = ('event_id', 'event_url', 'task_name', 'event_date')
+        if rows and not (settings.db.bulk_load and bulk_load(db, db.table_events, columns, rows, ignore=True)):
+            db.execute(f"""
+                INSERT IGNORE INTO {db.table_events} ({', '.join(columns)}) 
+                VALUES (%s, %s, %s, %s)
+            """, rows, many=True)
+        db.execute(f"""
+            INSERT INTO {db.table_event_urls} (event_id, event_url, lastmod, last_enqueued)
+            VALUES (%s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE
+                event_url = VALUES(event_url),
+                lastmod = VALUES(lastmod),
+                last_enqueued = VALUES(last_enqueued)
+        """, [(event_id, url, entry.lastmod) for (event_id, url, *_), entry in zip(all_rows, batch)], many=True)
+        db.connection.commit()
+
+    def requeue_known(self, db: Db, rows: list[tuple], task_name: str) -> list[tuple]:
+        """Возвращает в очередь уже известные события вместо вставки новой строки под сегодняшним task_name.
+        Возвращает строки событий, которых в очереди ещё нет.
+        """
+        event_ids = [row[0] for row in rows]
+        db.execute(f"""
+            SELECT event_id, MAX(id) FROM {db.table_events}
+            WHERE event_id IN ({', '.join(['%s'] * len(event_ids))})
+            GROUP BY event_id
+        """, tuple(event_ids))
+        known = dict(db.cursor.fetchall())
+        # Событие, которое сейчас обходится, не трогаем: после обхода планировщик вернёт его сам
+        db.execute(f"""
+            UPDATE IGNORE {db.table_events}
+            SET status=NULL, next_due_at=NULL, task_name=%s, event_url=%s, event_date=%s
+            WHERE id=%s AND (status IS NULL OR status <> 'processing')
+        """, [(task_name, url, event_date, known[event_id])
+              for event_id, url, _, event_date in rows if event_id in known], many=True)
+        return [row for row in rows if row[0] not in known]
+
+    def event_id(self, url: str) -> str:
+        return url.rstrip('/').split('/')[-1]
+
+    def event_date(self, url: str) -> datetime | None:
+        """Дата события из slug в URL, без времени - полночь"""
+        match = EVENT_DATE_RE.search(url)
+        if not match:
             return None
+        year, month, day, hour, minute, meridiem = match.groups()
+        hour = int(hour or 0) % 12 + (12 if meridiem == 'pm' else 0)
         try:
-            random.shuffle(self.proxies_list)
-            proxies = {'http': self.proxies_list[0], 'https': self.proxies_list[0]}
-            headers = {
-                "User-Agent": "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
-                "Accept": "*/*",
-                "Accept-Language": "en-US,en;q=0.9",
-                "Referer": "https://www.google.com/",
-                "Connection": "keep-alive"
-                }
-            response = requests.get(url, proxies=proxies, headers=headers, timeout=10)
-            response.raise_for_status()
-            return response.text
-        except:
-            pass
-        return self.get_page_response(url, count_retry + 1)
\ No newline at end of file
+            return datetime(int(year), int(month), int(day), hour, int(minute or 0))
+        except ValueError:
+            return None
+            
+    def get_links(self, content: bytes) -> list:
+        return list({entry.loc: entry for entry in iter_sitemap(content)}.values())
+
+    def get_session(self) -> requests.Session:
+        """Своя сессия на поток: соединения переиспользуются между запросами"""
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            concurrency = settings.discovery.concurrency
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update(HEADERS)
+            self.local.session = session
+        return session
+
+    def get_page_response(self, url: str, headers: dict = None) -> requests.Response | None:
+        max_retries = settings.discovery.max_retries
+        for attempt in range(max_retries + 1):
+            try:
+                proxy = random.choice(self.proxies_list)
+                proxies = {'http': proxy, 'https': proxy}
+                response = self.get_session().get(url, proxies=proxies, headers=headers,
+                                                  timeout=settings.discovery.timeout)
+                response.raise_for_status()
+                return response
+            except requests.RequestException:
+                if attempt < max_retries:
+                    backoff = settings.discovery.backoff
+                    time.sleep(backoff * 2 ** attempt + random.uniform(0, backoff))
+        self.logger.critical(f'There is not page content from link {url}')
+        return None
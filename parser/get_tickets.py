@@ -1,15 +1,19 @@
 import time
-import shutil
-import json
-import gzip
 import logging
-from datetime import datetime
+from collections import deque
+from archive.payloads import PayloadArchive
+from config.settings import settings
+from driver.capture import CdpCapture
 from driver.dynamic import ChromeWebDriver
+from driver.pool import Browser, BrowserPool
 from utils.logger import Logger
 from db.core import Db
-from pyvirtualdisplay import Display
-import sys
+from db.scheduler import finish_events
+from db.writer import TicketJob, TicketWriter, WriterStopped, write_tickets
+from parser.decoding import decode_listing_rows
 import os
+import socket
+import threading
 
 
 logging.getLogger('urllib3.connectionpool').setLevel(logging.ERROR)
@@ -18,129 +22,211 @@ logging.getLogger('seleniumwire.thirdparty.mitmproxy').setLevel(logging.CRITICAL
 logging.getLogger('urllib3').setLevel(logging.ERROR)
 
 class GetTickets:
-    def __init__(self):
+    def __init__(self, worker_id: int | None = None, writer: TicketWriter | None = None,
+                 pool: BrowserPool | None = None, stop_event=None, archive: PayloadArchive | None = None):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{worker_id or threading.get_ident()}"
         self.db = None
         self.driver = None
         self.folder_temp = None
         self.logger = Logger().get_logger(__name__)
-        self.display = None
+        self.leased_events = deque()
+        self.writer = writer
+        self.capture = None
+        self.pool = pool
+        self.browser = None
+        self.archive = archive
+        # threading.Event или multiprocessing.Event: после set() поток дообрабатывает текущее событие и выходит
+        self.stop_event = stop_event or threading.Event()
+        self.state = 'starting'
+        self.events_done = 0
+        self.errors = 0
+        # ошибок браузера подряд - от них зависит пауза перед следующим запуском
+        self.failures = 0
+        # скользящее среднее времени на событие, секунд
+        self.page_time = None
 
     def get(self):
+        """Обходит события до остановки. После ошибки браузер пересоздаётся с нарастающей паузой"""
         try:
-            if sys.platform == 'linux':
-                self.display = Display(visible=False)    
-                self.display.start()    
-            chrome_driver = ChromeWebDriver()
-            self.driver, self.folder_temp, self.current_proxy = chrome_driver.create_driver()
             self.db = Db()
+            while not self.stop_event.is_set():
+                try:
+                    if not self.browser:
+                        self.state = 'launching'
+                        self.open_browser()
+                    self.process_events()
+                except WriterStopped:
+                    # Без писателя обходить бессмысленно - процесс упадёт, и супервизор его перезапустит
+                    raise
+                except Exception as ex:
+                    self.errors += 1
+                    self.failures += 1
+                    self.state = 'error'
+                    if 'DataDome' not in str(ex):
+                        self.logger.error(f"Ошибка воркера {self.worker_id}: {ex}")
+                    self.close_browser()
+                    self.stop_event.wait(min(2 ** self.failures, 60))
+        finally:
+            self.state = 'stopped'
+            self.close_driver()
 
-            while True:
-                self.task_id = None
-                self.task_name = None
+    def process_events(self) -> None:
+        """Обрабатывает события до остановки. Пока очереди нечего выдать (события ещё не подошли
+        по расписанию, ошибка MySQL), ждёт TASKS_IDLE_INTERVAL и спрашивает снова
+        """
+        while not self.stop_event.is_set():
+            self.task_id = None
+            self.event_id = None
+            self.task_name = None
+            self.state = 'claiming'
+            try:
                 event_url = self.get_event_url()
-                if not event_url:
-                    break
-                self.get_api_content(event_url)
-        except Exception as ex:
-            if 'DataDome' in str(ex):
-                self.close_driver()
-                return self.get()
+            except Exception as ex:
+                self.errors += 1
+                self.logger.error(f"Ошибка при получении события: {ex}")
+                event_url = None
+            if not event_url:
+                self.state = 'idle'
+                self.stop_event.wait(settings.tasks.idle_interval)
+                continue
+            self.state = 'scraping'
+            started = time.monotonic()
+            self.get_api_content(event_url)
+            elapsed = time.monotonic() - started
+            self.page_time = elapsed if self.page_time is None else 0.8 * self.page_time + 0.2 * elapsed
+            self.events_done += 1
+            self.failures = 0
+            self.recycle_browser()
+
+    def open_browser(self):
+        if self.pool:
+            self.browser = self.pool.acquire()
+        else:
+            chrome_driver = ChromeWebDriver()
+            self.browser = Browser(*chrome_driver.create_driver(template_dir=settings.browsers.template_dir))
+        self.driver, self.folder_temp, self.current_proxy = \
+            self.browser.driver, self.browser.folder_temp, self.browser.proxy
+        if settings.capture.mode == 'cdp':
+            self.capture = CdpCapture(self.driver.options.debugger_address)
+
+    def close_browser(self):
+        if self.capture:
+            self.capture.close()
+            self.capture = None
+        if self.browser:
+            if self.pool:
+                # Закроет и удалит профиль фоновый поток пула
+                self.pool.release(self.browser)
             else:
-                print(ex)
-                self.close_driver()
-                return self.get()
-        finally:
-            self.close_driver()
+                self.browser.close()
+            self.browser = None
+        self.driver = None
+        self.folder_temp = None
+
+    def recycle_browser(self):
+        """Меняет браузер, который обошёл слишком много страниц, работает слишком долго, разросся
+        или потерял соединение DevTools (в режиме cdp)
+        """
+        self.browser.pages += 1
+        reason = self.browser.recycle_reason()
+        if not reason and self.capture and not self.capture.is_alive():
+            reason = "соединение DevTools закрыто"
+        if reason:
+            self.logger.info(f"Замена браузера: {reason}")
+            self.close_browser()
+            self.open_browser()
 
     def close_driver(self):
-        if self.driver:
-            try:
-                self.driver.quit()
-            except:
-                pass
-        if self.folder_temp:
-            try:
-                time.sleep(2)
-                shutil.rmtree(self.folder_temp)
-            except:
-                pass
-        if self.display:
-            try:
-                self.display.stop()
-            except:
-                pass
+        self.close_browser()
         if self.db:
+            self.release_leased_events()
             self.db.close_connection()
 
+    def release_leased_events(self):
+        """Возвращает в очередь арендованные, но не начатые события - иначе после остановки
+        они ждали бы истечения аренды. Уже обойдённые события допишет писатель.
+        """
+        if not self.leased_events:
+            return
+        try:
+            released = self.db.release_leases(self.worker_id, [event[0] for event in self.leased_events])
+            self.leased_events.clear()
+            if released:
+                self.logger.info(f"Возвращено в очередь не начатых событий: {released}")
+        except Exception as ex:
+            self.logger.error(f"Ошибка возврата событий в очередь: {ex}")
+
     def update_status(self, status: str):
         if self.task_id:
-            sql = f"UPDATE {self.db.table_events} SET status=%s WHERE id=%s"
-            self.db.insert(sql,(status, self.task_id))
+            try:
+                finish_events(self.db, [(self.task_id, self.worker_id, status, None)])
+                self.db.connection.commit()
+            except Exception as ex:
+                # Событие останется в 'processing' без продления аренды - его вернёт LeaseReaper
+                self.logger.error(f"Ошибка записи статуса события {self.task_id}: {ex}")
 
     def get_event_url(self) -> str | None:
-        try:
-            sql = f"SELECT id, event_url, task_name FROM {self.db.table_events} WHERE status IS NULL ORDER BY RAND() LIMIT 1 FOR UPDATE"
-            rows = self.db.select(sql)
-            if not rows:
-                return None
-            self.task_id = rows[0][0]
-            self.task_name = rows[0][2]
-            self.update_status('processing')
-            return rows[0][1]
-        except Exception as ex:
-            self.logger.error(f"Ошибка при получении события: {ex}")
-        return None
+        """URL следующего арендованного события или None, если очередь пуста. Ошибки MySQL пробрасываются"""
+        if self.leased_events:
+            leased_ids = self.db.renew_leases(self.worker_id, [event[0] for event in self.leased_events])
+            self.leased_events = deque(event for event in self.leased_events if event[0] in leased_ids)
+        if not self.leased_events:
+            self.leased_events.extend(self.db.claim_events(self.worker_id, settings.tasks.claim_batch_size))
+        if not self.leased_events:
+            return None
+        self.task_id, self.event_id, event_url, self.task_name = self.leased_events.popleft()
+        return event_url
     
     def get_api_content(self, event_url: str, wait_time: int = 30):
         try:
             self.driver.execute_cdp_cmd("Network.clearBrowserCache", {})
-            del self.driver.requests
+            if self.capture:
+                self.capture.reset()
+            else:
+                del self.driver.requests
             self.driver.get(event_url)
             
-            api_request = None
+            response = None
             start_time = time.time()
             while time.time() - start_time < wait_time:
-                for request in self.driver.requests:
-                    if '/api/event_listings_v2' in request.url:
-                        print('found event_listings_v2')
-                        if request.response and request.response.status_code == 200:
-                            api_request = request
-                            break
-                if api_request:
+                response = self.find_api_response()
+                if response is not None:
                     break 
-                time.sleep(0.5)
+                if self.capture:
+                    if not self.capture.is_alive():
+                        raise Exception('соединение DevTools закрыто')
+                    self.capture.wait(0.5)
+                else:
+                    time.sleep(0.5)
                 if event_url != self.driver.current_url:
                     raise Exception(f'url unavailable')
                 has_captcha, ip_blocked = self.check_captcha()
                 if ip_blocked or has_captcha:
                     raise Exception('DataDome')
 
-            if not api_request:
+            if response is None:
                 self.update_status(None)
                 # os.makedirs('screenshots', exist_ok=True)
                 # self.driver.save_screenshot(f'screenshots/{self.task_id}.png')
                 print(f'No api_request')
                 return
             
-            if api_request.response:
-                try:
-                    response_body = api_request.response.body
-                    try:
-                        response_content = gzip.decompress(response_body).decode('utf-8')
-                    except:
-                        response_content = response_body.decode('utf-8')
-                    response_data = json.loads(response_content)
-                    if response_data:
-                        all_listings = self.get_all_listings(response_data)
-                        if all_listings:
-                            self.insert_tikects(all_listings, self.task_name)
-                            self.update_status('success')
-                        else:
-                            self.update_status('no listings')
-                except Exception as ex:
-                    self.logger.error(f"Ошибка сохранения response: {ex}")
-            else:
+            try:
+                response_body, content_encoding = response
+                if self.archive:
+                    self.archive.submit(self.event_id, self.task_name, response_body, content_encoding)
+                rows = decode_listing_rows(response_body, self.task_name, content_encoding)
+                if rows is None:
+                    self.update_status(None)
+                    return
+                self.insert_tikects(rows, self.task_name)
+            except WriterStopped:
+                raise
+            except Exception as ex:
+                self.logger.error(f"Ошибка сохранения response: {ex}")
                 self.update_status(None)
+        except WriterStopped:
+            raise
         except Exception as ex:
             self.update_status(None)
             if 'DataDome' in str(ex):
@@ -152,100 +238,36 @@ class GetTickets:
             self.update_status(None)
         return
 
-    def get_all_listings(self, data: dict):
-        all_listings = []
-        if data.get('listings'):
-            for listing in data['listings']:
-                try:
-                    listing_dict = self.listing_to_dict(listing)
-                except Exception as ex:
-                    self.logger.error(f"Ошибка преобразования листинга: {ex}")
-                    continue
-                all_listings.append(listing_dict)
-        return all_listings 
+    def find_api_response(self) -> tuple[bytes, str | None] | None:
+        """(тело, Content-Encoding) ответа event_listings_v2 со статусом 200 или None, если его ещё нет"""
+        if self.capture:
+            # CDP отдаёт тело уже распакованным
+            body = self.capture.body()
+            return None if body is None else (body, None)
+        for request in self.driver.requests:
+            if '/api/event_listings_v2' in request.url:
+                print('found event_listings_v2')
+                if request.response and request.response.status_code == 200:
+                    return request.response.body, request.response.headers.get('Content-Encoding')
+        return None
 
-    def listing_to_dict(self, listing: dict) -> dict:    
-        seat_numbers = listing.get('ss', [])
-        seat_numbers_str = ','.join(map(str, seat_numbers)) if seat_numbers else ''
-        cache_time = datetime.utcnow().strftime('%m/%d/%Y %H:%M:%S')
-        return {
-            # "marketplace": 'seatgeek',
-            "event_id": listing.get('e', ''),
-            "listing_id": listing.get('id', ''),
-            "section_id": listing.get('s', ''),
-            "section_name": listing.get('sf', ''),
-            "section_name_raw": listing.get('sr', ''),
-            "row_name": listing.get('r', ''),
-            "seat_numbers": seat_numbers_str,
-            "ticket_quantity_lots": listing.get('q', ''),
-            "ticket_quantity": listing.get('q', ''),
-            "value_score": listing.get('dq', {}).get('dq', ''),
-            "quality_score": listing.get('dq', {}).get('ddq', ''),
-            "listing_notes": listing.get('ptd', ''),
-            "display_price_pre_checkout": listing.get('p', ''),
-            "all_in_price_pre_checkout": listing.get('pf', ''),
-            "display_price_checkout": listing.get('dp', ''),
-            "buyer_fee_checkout": listing.get('f', ''),
-            "other_fee_checkout": '',
-            "sales_tax_checkout": '',
-            "all_in_price_checkout": listing.get('dp', ''),
-            "cache_time": cache_time
-        }      
-    
-    def insert_tikects(self, datas: list[dict], task_name: str):
-        if not datas:
-            return
+    def insert_tikects(self, rows: list[tuple], task_name: str):
+        """Отдаёт листинги события писателю. Статус ставится в той же транзакции, что и вставка.
+        Пустой список тоже отправляется: в delta-режиме он помечает прошлые листинги как удалённые.
+        """
         try:
-            sql = f"""
-                INSERT INTO {self.db.table_tickets} (
-                    event_id, listing_id, section_id, section_name, section_name_raw,
-                    row_name, seat_numbers, ticket_quantity_lots, ticket_quantity,
-                    value_score, quality_score, listing_notes,
-                    display_price_pre_checkout, all_in_price_pre_checkout,
-                    display_price_checkout, buyer_fee_checkout,
-                    other_fee_checkout, sales_tax_checkout, all_in_price_checkout,
-                    cache_time, task_name
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                )
-            """
-            batch_size = 1000
-            total_inserted = 0
-            for i in range(0, len(datas), batch_size):
-                batch = datas[i:i + batch_size]
-                values_list = []
-                for listing in batch:
-                    values = (
-                        listing.get('event_id'),
-                        listing.get('listing_id'),
-                        listing.get('section_id'),
-                        listing.get('section_name'),
-                        listing.get('section_name_raw'),
-                        listing.get('row_name'),
-                        listing.get('seat_numbers'),
-                        listing.get('ticket_quantity_lots'),
-                        listing.get('ticket_quantity'),
-                        listing.get('value_score'),
-                        listing.get('quality_score'),
-                        listing.get('listing_notes'),
-                        listing.get('display_price_pre_checkout'),
-                        listing.get('all_in_price_pre_checkout'),
-                        listing.get('display_price_checkout'),
-                        listing.get('buyer_fee_checkout'),
-                        listing.get('other_fee_checkout'),
-                        listing.get('sales_tax_checkout'),
-                        listing.get('all_in_price_checkout'),
-                        listing.get('cache_time'),
-                        task_name
-                    )
-                    values_list.append(values)
-                self.db.cursor.executemany(sql, values_list)
-                self.db.connection.commit()
-                total_inserted += len(values_list)
-            print(f'  Вставлено {total_inserted} листингов')
+            status = 'success' if rows else 'no listings'
+            job = TicketJob(self.task_id, self.worker_id, self.event_id, task_name, rows, status)
+            if self.writer:
+                self.writer.submit(job)
+            else:
+                total_inserted = write_tickets(self.db, [job])
+                print(f'  Вставлено {total_inserted} листингов')
+        except WriterStopped:
+            raise
         except Exception as ex:
             print(f'Ошибка вставки tickets: {ex}')
+            self.update_status(None)
 
     def check_captcha(self) -> tuple[bool, bool]:
         """Проверяет наличие АКТИВНОЙ капчи DataDome на странице
@@ -0,0 +1,52 @@
+from datetime import datetime
+from utils.logger import Logger
+
+
+logger = Logger().get_logger(__name__)
+
+_NO_SCORES = {}
+
+
+def listings_to_rows(listings: list, task_name: str, cache_time: datetime = None) -> list[tuple]:
+    """Переводит массив listings из ответа event_listings_v2 сразу в кортежи в порядке TICKET_COLUMNS,
+    без промежуточного словаря на листинг. Время снимка одно на весь ответ.
+    """
+    if cache_time is None:
+        cache_time = datetime.utcnow().replace(microsecond=0)
+    scrape_date = cache_time.date()
+    rows = []
+    append = rows.append
+    for listing in listings:
+        try:
+            get = listing.get
+            seats = get('ss')
+            scores = get('dq') or _NO_SCORES
+            quantity = get('q')
+            price_checkout = get('dp')
+            append((
+                get('e'),
+                get('id'),
+                get('s'),
+                get('sf'),
+                get('sr'),
+                get('r'),
+                ','.join(map(str, seats)) if seats else None,
+                quantity,
+                quantity,
+                scores.get('dq'),
+                scores.get('ddq'),
+                get('ptd'),
+                get('p'),
+                get('pf'),
+                price_checkout,
+                get('f'),
+                None,
+                None,
+                price_checkout,
+                cache_time,
+                task_name,
+                scrape_date,
+            ))
+        except Exception as ex:
+            logger.error(f"Ошибка преобразования листинга: {ex}")
+    return rows
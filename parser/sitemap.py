@@ -0,0 +1,35 @@
+import gzip
+import io
+from collections import namedtuple
+from lxml import etree
+
+
+SitemapEntry = namedtuple('SitemapEntry', ['loc', 'lastmod'])
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def iter_sitemap(content: bytes):
+    """Потоково разбирает sitemap или sitemap index (в том числе .xml.gz) и лениво отдаёт
+    SitemapEntry(loc, lastmod). Обработанные <url>/<sitemap> сразу удаляются из дерева,
+    так что память не растёт с размером файла.
+    """
+    stream = io.BytesIO(content)
+    if content[:2] == GZIP_MAGIC:
+        stream = gzip.GzipFile(fileobj=stream)
+    loc = lastmod = None
+    elements = etree.iterparse(stream, events=('end',), tag=('{*}loc', '{*}lastmod', '{*}url', '{*}sitemap'),
+                               resolve_entities=False, no_network=True, huge_tree=True)
+    for _, element in elements:
+        name = etree.QName(element).localname
+        if name == 'loc':
+            loc = (element.text or '').strip()
+        elif name == 'lastmod':
+            lastmod = (element.text or '').strip() or None
+        else:
+            if loc:
+                yield SitemapEntry(loc, lastmod)
+            loc = lastmod = None
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
@@ -0,0 +1,112 @@
+"""Повторная загрузка seatgeek_tickets из архива ответов (ARCHIVE_ENABLED) без браузеров, прокси и дисплеев.
+Заодно - нагрузочный тест записи в MySQL.
+
+    python replay.py --from 2025-03-01 --to 2025-03-14 --processes 4
+    python replay.py --dry-run          # только разбор ответов, без записи в БД
+
+По умолчанию пишутся только полные снимки в seatgeek_tickets: хэши листингов и
+seatgeek_listings_current отражают текущее состояние, и старые ответы не должны его откатывать.
+С --live-state ответы проходят тот же путь, что и при обходе (delta-режим, текущие листинги) -
+только для пустой базы или восстановления после потери этих таблиц.
+
+События делятся между процессами по event_id, и ответы одного события идут в порядке
+времени снимка - delta-режим сравнивает каждый ответ с предыдущим.
+"""
+import argparse
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from dotenv import load_dotenv
+from archive.payloads import iter_index, iter_payloads
+from config.settings import settings
+from parser.decoding import decode_listing_rows
+
+
+load_dotenv(override=True)
+
+
+def shard_of(event_id: str, shards: int) -> int:
+    return zlib.crc32(event_id.encode()) % shards
+
+
+def replay_shard(shard: int, shards: int, archive_dir: str, date_from: date | None, date_to: date | None,
+                 dry_run: bool, live_state: bool = False) -> tuple[int, int, float]:
+    """Загружает ответы своей доли событий. Возвращает (ответов, строк, секунд)"""
+    from db.core import Db
+    from db.writer import TicketJob, write_tickets
+
+    started = time.perf_counter()
+    entries = [entry for entry in iter_index(archive_dir, date_from, date_to)
+               if shard_of(entry.event_id, shards) == shard]
+    entries.sort(key=lambda entry: entry.scraped_at)
+
+    db = None if dry_run else Db()
+    jobs, job_events, job_rows = [], set(), 0
+    payloads = total_rows = 0
+
+    def flush():
+        nonlocal jobs, job_events, job_rows, total_rows
+        if jobs:
+            total_rows += write_tickets(db, jobs, history_only=not live_state)
+        jobs, job_events, job_rows = [], set(), 0
+
+    try:
+        for payload in iter_payloads(entries):
+            rows = decode_listing_rows(payload.body, payload.task_name, cache_time=payload.scraped_at) or []
+            payloads += 1
+            if dry_run:
+                total_rows += len(rows)
+                continue
+            # Два ответа одного события в одной пачке сравнились бы с одним и тем же прошлым снимком
+            if payload.event_id in job_events:
+                flush()
+            status = 'success' if rows else 'no listings'
+            jobs.append(TicketJob(None, None, payload.event_id, payload.task_name, rows, status))
+            job_events.add(payload.event_id)
+            job_rows += len(rows)
+            if job_rows >= settings.writer.batch_rows:
+                flush()
+        flush()
+    finally:
+        if db:
+            db.close_connection()
+    return payloads, total_rows, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Загрузка seatgeek_tickets из архива ответов')
+    parser.add_argument('--dir', default=settings.archive.dir, help='каталог архива (ARCHIVE_DIR)')
+    parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help='первый день, YYYY-MM-DD')
+    parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help='последний день, YYYY-MM-DD')
+    parser.add_argument('--processes', type=int, default=settings.workers.count)
+    parser.add_argument('--dry-run', action='store_true', help='только разбор, без записи в БД')
+    parser.add_argument('--live-state', action='store_true',
+                        help='обновлять хэши листингов и seatgeek_listings_current (перезапишет текущее состояние)')
+    args = parser.parse_args()
+
+    if not args.dry_run:
+        from db.core import IsDbTable
+        IsDbTable().check()
+
+    shards = max(1, args.processes)
+    started = time.perf_counter()
+    payloads = rows = 0
+    with ProcessPoolExecutor(max_workers=shards) as executor:
+        futures = [executor.submit(replay_shard, shard, shards, args.dir, args.date_from, args.date_to,
+                                   args.dry_run, args.live_state)
+                   for shard in range(shards)]
+        for future in as_completed(futures):
+            shard_payloads, shard_rows, seconds = future.result()
+            payloads += shard_payloads
+            rows += shard_rows
+            print(f"  Процесс: {shard_payloads} ответов, {shard_rows} строк за {seconds:.1f} с "
+                  f"({shard_rows / max(seconds, 1e-9):,.0f} строк/с)")
+
+    elapsed = time.perf_counter() - started
+    print(f"Загружено {payloads} ответов, {rows} строк за {elapsed:.1f} с: "
+          f"{rows / max(elapsed, 1e-9):,.0f} строк/с, {payloads / max(elapsed, 1e-9):,.1f} ответов/с")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+import threading
+from utils.logger import Logger
+
+
+class PeriodicTask(threading.Thread):
+    """Фоновый поток, который вызывает tick() раз в interval секунд"""
+
+    def __init__(self, name: str, interval: float):
+        super().__init__(name=name, daemon=True)
+        self.interval = interval
+        self.logger = Logger().get_logger(name)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as ex:
+                self.logger.error(f"Ошибка в фоновой задаче {self.name}: {ex}")
+
+    def tick(self):
+        raise NotImplementedError
+
+    def stop(self):
+        self._stop_event.set()
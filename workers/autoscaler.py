@@ -0,0 +1,97 @@
+import time
+from config.settings import settings
+from db.core import Db
+from utils.logger import Logger
+
+
+def read_cpu_times() -> tuple[int, int] | None:
+    """(занято, всего) в тиках по строке cpu из /proc/stat"""
+    try:
+        with open('/proc/stat') as file:
+            fields = [int(value) for value in file.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+    return sum(fields) - idle, sum(fields)
+
+
+def read_memory_available_mb() -> int | None:
+    try:
+        with open('/proc/meminfo') as file:
+            for line in file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class Autoscaler:
+    """Подбирает число воркеров по загрузке CPU, свободной памяти, очереди событий
+    и времени на страницу. За один шаг меняет число воркеров на одного.
+    """
+
+    def __init__(self):
+        self.logger = Logger().get_logger(__name__)
+        self.config = settings.autoscale
+        self.cpu_times = read_cpu_times()
+        self.last_change = 0.0
+
+    def clamp(self, count: int) -> int:
+        return max(self.config.min_workers, min(self.config.max_workers, count))
+
+    def cpu_usage(self) -> float | None:
+        """Доля занятого CPU с прошлого замера"""
+        current = read_cpu_times()
+        previous, self.cpu_times = self.cpu_times, current
+        if not current or not previous or current[1] == previous[1]:
+            return None
+        return (current[0] - previous[0]) / (current[1] - previous[1])
+
+    def backlog(self) -> int | None:
+        db = Db()
+        try:
+            return db.count_backlog()
+        except Exception as ex:
+            self.logger.error(f"Не удалось получить размер очереди: {ex}")
+            return None
+        finally:
+            db.close_connection()
+
+    def decide(self, workers: int, statuses) -> int:
+        """Новое число воркеров для текущих workers и последних WorkerStatus"""
+        config = self.config
+        cpu = self.cpu_usage()
+        memory = read_memory_available_mb()
+        backlog = self.backlog()
+        page_times = [status.page_time for status in statuses if status.page_time]
+        page_time = sum(page_times) / len(page_times) if page_times else None
+        metrics = (f"CPU {cpu:.0%}" if cpu is not None else "CPU ?",
+                   f"свободно {memory} МБ" if memory is not None else "память ?",
+                   f"очередь {backlog}" if backlog is not None else "очередь ?",
+                   f"{page_time:.1f} с/страница" if page_time else "с/страница ?")
+
+        target, reason = workers, None
+        if memory is not None and memory < config.memory_reserve_mb:
+            target, reason = workers - 1, "мало свободной памяти"
+        elif cpu is not None and cpu > config.cpu_high:
+            target, reason = workers - 1, "CPU перегружен"
+        elif page_time and page_time > config.page_time_high:
+            target, reason = workers - 1, "страницы грузятся слишком долго"
+        elif backlog is not None and backlog == 0:
+            target, reason = workers - 1, "очередь пуста"
+        elif (backlog is not None and backlog > workers * config.backlog_per_worker
+              and (cpu is None or cpu < config.cpu_low)
+              and (memory is None or memory > config.memory_reserve_mb + config.worker_memory_mb)):
+            target, reason = workers + 1, "очередь растёт, ресурсы есть"
+
+        target = self.clamp(target)
+        if target != workers and time.monotonic() - self.last_change < config.cooldown:
+            self.logger.debug(f"Масштабирование отложено ({reason}): {', '.join(metrics)}")
+            return workers
+        if target != workers:
+            self.last_change = time.monotonic()
+            self.logger.info(f"Воркеров {workers} -> {target}: {reason}; {', '.join(metrics)}")
+        else:
+            self.logger.debug(f"Воркеров {workers}: {', '.join(metrics)}")
+        return target
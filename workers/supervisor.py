@@ -0,0 +1,244 @@
+"""Воркеры GetTickets в отдельных процессах: у каждого свой интерпретатор, Chrome и писатель,
+так что разбор ответов и mitmproxy не делят один GIL. Супервизор перезапускает упавшие
+процессы с нарастающей паузой, а по SIGTERM даёт им дообработать текущее событие.
+"""
+import multiprocessing
+import queue
+import signal
+import socket
+import threading
+import time
+from collections import namedtuple
+from config.settings import settings
+from db.core import Db
+from driver.display import DisplayManager
+from utils.logger import Logger
+from workers.autoscaler import Autoscaler
+
+
+# Соединения GetTickets, писателя и справочника секций - больше процессу воркера не нужно
+WORKER_DB_POOL_SIZE = 4
+
+# Процесс, проработавший дольше, считается поднявшимся - счётчик падений сбрасывается
+STABLE_UPTIME = 300
+
+WorkerStatus = namedtuple('WorkerStatus', ['worker_id', 'pid', 'state', 'events', 'errors', 'page_time', 'updated_at'])
+
+
+def worker_owner(worker_id: int, pid: int) -> str:
+    """lease_owner, под которым GetTickets процесса pid забирает события"""
+    return f"{socket.gethostname()}:{pid}:{worker_id}"
+
+
+def worker_main(worker_id: int, status_queue, stop_event, display: str | None = None) -> None:
+    """Точка входа процесса воркера"""
+    from archive.payloads import PayloadArchive
+    from db.writer import TicketWriter
+    from driver.display import use_display
+    from driver.pool import BrowserPool
+    from parser.get_tickets import GetTickets
+
+    # Ctrl+C получает вся группа процессов - останавливает только супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    settings.db.pool_size = min(settings.db.pool_size, WORKER_DB_POOL_SIZE)
+    use_display(display)
+
+    writer = TicketWriter()
+    writer.start()
+    pool = None
+    if settings.browsers.pool_size > 0:
+        # Запасные браузеры процесса - замена по политике переработки не ждёт запуска Chrome
+        pool = BrowserPool(size=settings.browsers.pool_size)
+        pool.start()
+    archive = None
+    if settings.archive.enabled:
+        archive = PayloadArchive()
+        archive.start()
+    worker = GetTickets(worker_id, writer, pool, stop_event, archive)
+
+    def report():
+        status_queue.put(WorkerStatus(worker_id, multiprocessing.current_process().pid, worker.state,
+                                      worker.events_done, worker.errors, worker.page_time, time.time()))
+
+    reporter_stop = threading.Event()
+
+    def report_loop():
+        while not reporter_stop.wait(settings.workers.status_interval):
+            report()
+
+    threading.Thread(target=report_loop, name='worker-status', daemon=True).start()
+    try:
+        worker.get()
+    finally:
+        reporter_stop.set()
+        writer.close()
+        if archive:
+            archive.close()
+        if pool:
+            pool.close()
+        report()
+
+
+class WorkerProcess:
+    def __init__(self, worker_id: int, stop_event):
+        self.worker_id = worker_id
+        self.stop_event = stop_event
+        self.process = None
+        self.started_at = None
+        self.failures = 0
+        self.restart_at = None
+        # остановлен автоскейлером - после выхода не перезапускается
+        self.retiring = False
+
+
+class Supervisor:
+    def __init__(self, count: int = None, displays: DisplayManager = None):
+        self.displays = displays
+        self.logger = Logger().get_logger(__name__)
+        # spawn, а не fork: в родителе уже есть потоки и пул соединений MySQL
+        self.context = multiprocessing.get_context('spawn')
+        self.status_queue = self.context.Queue()
+        self.stop_event = threading.Event()
+        self.autoscaler = Autoscaler() if settings.autoscale.enabled else None
+        count = settings.workers.count if count is None else count
+        if self.autoscaler:
+            count = self.autoscaler.clamp(count)
+        self.workers = {}
+        self.last_worker_id = 0
+        for _ in range(count):
+            self.new_worker()
+        self.statuses = {}
+
+    def new_worker(self) -> WorkerProcess:
+        self.last_worker_id += 1
+        worker = WorkerProcess(self.last_worker_id, self.context.Event())
+        self.workers[worker.worker_id] = worker
+        return worker
+
+    def active_workers(self) -> list[WorkerProcess]:
+        return [worker for worker in self.workers.values() if not worker.retiring]
+
+    def start_worker(self, worker: WorkerProcess) -> None:
+        worker.process = self.context.Process(
+            target=worker_main,
+            args=(worker.worker_id, self.status_queue, worker.stop_event,
+                  self.displays.assign(worker.worker_id) if self.displays else None),
+            name=f"worker-{worker.worker_id}")
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+
+    def stop(self, *_) -> None:
+        if not self.stop_event.is_set():
+            self.logger.info("Остановка: воркеры дообрабатывают текущие события")
+        self.stop_event.set()
+        for worker in self.workers.values():
+            worker.stop_event.set()
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for worker in list(self.workers.values()):
+            if self.stop_event.is_set():
+                break
+            self.start_worker(worker)
+            self.stop_event.wait(settings.workers.start_delay)
+        last_report = last_scale = time.monotonic()
+        while not self.stop_event.is_set():
+            self.collect_statuses(timeout=1)
+            for worker in list(self.workers.values()):
+                self.check_worker(worker)
+            if time.monotonic() - last_report >= settings.workers.status_interval:
+                self.log_statuses()
+                last_report = time.monotonic()
+            if self.autoscaler and time.monotonic() - last_scale >= settings.autoscale.interval:
+                self.autoscale()
+                last_scale = time.monotonic()
+        self.drain()
+
+    def autoscale(self) -> None:
+        active = self.active_workers()
+        statuses = [self.statuses[worker.worker_id] for worker in active if worker.worker_id in self.statuses]
+        target = self.autoscaler.decide(len(active), statuses)
+        for _ in range(target - len(active)):
+            self.start_worker(self.new_worker())
+        surplus = max(0, len(active) - target)
+        for worker in sorted(active, key=lambda worker: worker.worker_id, reverse=True)[:surplus]:
+            # Воркер дообработает текущее событие и выйдет с кодом 0
+            worker.retiring = True
+            worker.stop_event.set()
+
+    def check_worker(self, worker: WorkerProcess) -> None:
+        if worker.process is None and worker.retiring:
+            # Ждал перезапуска после падения - запускать уже не нужно
+            del self.workers[worker.worker_id]
+            return
+        if worker.process is None or worker.process.is_alive():
+            if worker.restart_at and time.monotonic() >= worker.restart_at:
+                self.start_worker(worker)
+            return
+        exitcode = worker.process.exitcode
+        pid = worker.process.pid
+        worker.process.close()
+        worker.process = None
+        if worker.retiring:
+            del self.workers[worker.worker_id]
+            self.statuses.pop(worker.worker_id, None)
+            if exitcode != 0:
+                self.release_leases(worker.worker_id, pid)
+            return
+        # Без остановки воркер не выходит, даже если очередь пуста - любой выход перезапускается
+        self.release_leases(worker.worker_id, pid)
+        if time.monotonic() - worker.started_at >= STABLE_UPTIME:
+            worker.failures = 0
+        worker.failures += 1
+        delay = min(settings.workers.restart_backoff * 2 ** (worker.failures - 1),
+                    settings.workers.restart_backoff_max)
+        worker.restart_at = time.monotonic() + delay
+        self.logger.warning(f"Воркер #{worker.worker_id} завершился с кодом {exitcode}, "
+                            f"перезапуск через {delay:.0f} с")
+
+    def release_leases(self, worker_id: int, pid: int) -> None:
+        db = Db()
+        try:
+            count = db.release_leases(worker_owner(worker_id, pid))
+            if count:
+                self.logger.info(f"Возвращено в очередь {count} событий воркера #{worker_id}")
+        except Exception as ex:
+            self.logger.error(f"Ошибка возврата событий воркера #{worker_id}: {ex}")
+        finally:
+            db.close_connection()
+
+    def collect_statuses(self, timeout: float = 0) -> None:
+        try:
+            status = self.status_queue.get(timeout=timeout)
+            while True:
+                self.statuses[status.worker_id] = status
+                status = self.status_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def log_statuses(self) -> None:
+        if not self.statuses:
+            return
+        summary = ', '.join(f"#{status.worker_id} {status.state} {status.events}/{status.errors}"
+                            for status in sorted(self.statuses.values()))
+        self.logger.info(f"Воркеры (событий/ошибок): {summary}")
+
+    def drain(self) -> None:
+        """Ждёт, пока воркеры допишут текущие события, затем добивает оставшихся"""
+        self.stop()
+        deadline = time.monotonic() + settings.workers.drain_timeout
+        for worker in self.workers.values():
+            if worker.process is not None:
+                worker.process.join(max(0, deadline - time.monotonic()))
+        for worker in self.workers.values():
+            if worker.process is not None and worker.process.is_alive():
+                self.logger.warning(f"Воркер #{worker.worker_id} не остановился за "
+                                    f"{settings.workers.drain_timeout:.0f} с, завершаю принудительно")
+                worker.process.kill()
+                worker.process.join()
+                self.release_leases(worker.worker_id, worker.process.pid)
+        self.collect_statuses()
+        self.log_statuses()